@@ -0,0 +1,132 @@
+import math
+import re
+from collections import namedtuple
+
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+# registers of each sketch are 2**precision bytes; 14 gives a standard error of 0.8%
+DEFAULT_PRECISION = 14
+
+# approx_count_distinct of sql server has an error of at most 2% with a 97% probability
+SERVER_ERROR = 0.02
+
+COUNT_DISTINCT = re.compile(r'count\s*\(\s*distinct\s+', re.IGNORECASE)
+
+# fails in the servers without approx_count_distinct (before sql server 2019)
+PROBE_SQL = 'select approx_count_distinct(x) from (values (1)) as t(x)'
+
+
+def has_count_distinct(sql):
+    return COUNT_DISTINCT.search(sql) is not None
+
+
+# same query with the approximate distinct count of the server
+def server_sql(sql):
+    return COUNT_DISTINCT.sub('approx_count_distinct(', sql)
+
+
+# relative error of a sketch with 95% confidence (two standard errors)
+def sketch_error(precision=DEFAULT_PRECISION):
+    return 2 * 1.04 / math.sqrt(2 ** precision)
+
+
+# query that streams one row per (group, key) instead of counting in the server, plus the
+# order and the limit of the original to apply them to the counts
+SketchPlan = namedtuple('SketchPlan', ['sql', 'limit', 'descending'])
+
+
+def sketch_plan(sql, metric_column):
+    if len(COUNT_DISTINCT.findall(re.split(r'\bfrom\b', sql, 1, flags=re.IGNORECASE)[0])) != 1:
+        raise ValueError('La consulta debe tener un solo count(distinct ...) en sus columnas')
+    limit = None
+    top = re.match(r'\s*select\s+top\s+(\d+)\s+', sql, re.IGNORECASE)
+    if top:
+        limit = int(top.group(1))
+        sql = 'select ' + sql[top.end():]
+    descending = None
+    order = re.search(r'\border\s+by\b(.*)$', sql, re.IGNORECASE | re.DOTALL)
+    if order:
+        clause = order.group(1).lower()
+        if 'count' in clause or metric_column.lower() in clause:
+            descending = 'desc' in clause
+        sql = sql[:order.start()]
+    sql = re.sub(r'\bgroup\s+by\b.*$', '', sql, flags=re.IGNORECASE | re.DOTALL)
+    #count(distinct x) as name -> x as name, the parenthesis that closed the count is removed
+    match = COUNT_DISTINCT.search(sql)
+    depth, end = 1, match.end()
+    while depth:
+        depth += {'(': 1, ')': -1}.get(sql[end], 0)
+        end += 1
+    sql = sql[:match.start()] + sql[match.end():end - 1] + sql[end:]
+    return SketchPlan(sql, limit, descending)
+
+
+# one hyperloglog sketch for each group, the registers of all of them in one matrix
+class GroupedSketch:
+    def __init__(self, precision=DEFAULT_PRECISION):
+        self.precision = precision
+        self.groups = {}
+        self._registers = np.zeros((16, 2 ** precision), dtype=np.uint8)
+
+    def _index(self, group):
+        index = self.groups.get(group)
+        if index is None:
+            index = self.groups[group] = len(self.groups)
+            if index == len(self._registers):
+                self._registers = np.vstack([self._registers, np.zeros_like(self._registers)])
+        return index
+
+    # rows with the columns of the group first and the key last; null keys are not counted
+    def add_rows(self, filas):
+        frame = pd.DataFrame.from_records(filas).dropna(subset=[len(filas[0]) - 1]) if filas else None
+        if frame is None or frame.empty:
+            return
+        keys = frame.pop(frame.columns[-1]).to_numpy()
+        #a batch with null keys reads the others as floats, they must hash like in the other batches
+        if keys.dtype.kind == 'f':
+            keys = keys.astype(np.int64)
+        codes, uniques = pd.factorize(pd.Series(list(frame.itertuples(index=False, name=None))))
+        indices = np.array([self._index(group) for group in uniques], dtype=np.int64)[codes]
+        #64 bit hash of the keys, the first bits choose the register
+        hashes = pd.util.hash_array(keys)
+        bucket = (hashes >> np.uint64(64 - self.precision)).astype(np.int64)
+        #position of the first 1 after the bits of the bucket; the last bit is set so it is never 0
+        rest = (hashes << np.uint64(self.precision)) | np.uint64(1 << (self.precision - 1))
+        rank = (64 - np.floor(np.log2(rest.astype(np.float64)))).astype(np.uint8)
+        np.maximum.at(self._registers, (indices, bucket), rank)
+
+    def counts(self):
+        registers = self._registers[:len(self.groups)].astype(np.float64)
+        m = 2 ** self.precision
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.power(2.0, -registers).sum(axis=1)
+        zeros = (registers == 0).sum(axis=1)
+        #few values: linear counting of the empty registers is more exact
+        small = (estimate <= 2.5 * m) & (zeros > 0)
+        estimate[small] = m * np.log(m / zeros[small])
+        return {group: int(round(estimate[index])) for group, index in self.groups.items()}
+
+
+# rows of the report from the counts of the sketch, with the order and limit of the original query
+def sketch_rows(sketch, plan):
+    filas = [(*group, count) for group, count in sketch.counts().items()]
+    if plan.descending is not None:
+        filas.sort(key=lambda fila: fila[-1], reverse=plan.descending)
+    return filas[:plan.limit] if plan.limit else filas
+
+
+# run the query of the plan and count its keys with the sketch as the batches arrive, the rows are not kept
+def count_with_sketch(cursor, plan, batch_size=50000, precision=DEFAULT_PRECISION, params=()):
+    cursor.execute(plan.sql, *params)
+    columns = [desc[0] for desc in cursor.description]
+    sketch = GroupedSketch(precision)
+    while True:
+        filas = cursor.fetchmany(batch_size)
+        if not filas:
+            break
+        sketch.add_rows([tuple(fila) for fila in filas])
+    cursor.close()
+    return columns, sketch_rows(sketch, plan)
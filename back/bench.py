@@ -0,0 +1,238 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import standin
+from approx import DEFAULT_PRECISION, count_with_sketch, sketch_error, sketch_plan
+from chart_data import reduce_chart
+from charts import render_chart
+from measures import build_dataframe, measures_of_tendency
+from queries import list_specs, load_queries_file
+from slow_queries import SlowQueryLog
+
+FETCH_BATCH_SIZE = int(os.getenv('FETCH_BATCH_SIZE', 1000))
+STAGES = ['execute', 'fetch', 'dataframe', 'statistics', 'chart_bar', 'chart_hist', 'chart_pie']
+
+
+# the same steps as a request of the app, each one returns what the next needs; the slow executions
+# go to the slow query log with the plan of the stand-in, like in the app
+def run_stages(conn, spec, graph_dir, slow_log=None):
+    state = {}
+
+    def execute():
+        state['started'] = time.perf_counter()
+        state['cursor'] = conn.cursor()
+        state['cursor'].execute(spec.sql)
+        state['execute_seconds'] = time.perf_counter() - state['started']
+
+    def fetch():
+        cursor = state.pop('cursor')
+        state['columns'] = [desc[0] for desc in cursor.description]
+        rows = []
+        while True:
+            filas = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not filas:
+                break
+            rows.extend(tuple(fila) for fila in filas)
+        seconds = time.perf_counter() - state['started']
+        if slow_log is not None and slow_log.is_slow(seconds):
+            slow_log.record(conn, cursor, spec.sql, spec.params, seconds,
+                            {'execute': state['execute_seconds'], 'fetch': seconds - state['execute_seconds']}, spec.id, len(rows))
+        cursor.close()
+        state['rows'] = rows
+
+    def dataframe():
+        state['df'] = build_dataframe(state['rows'], spec.columns)
+
+    def measures():
+        measures_of_tendency(state['df'][spec.metric_column])
+
+    #the reduction of the data is part of the time of each graph, as in the app
+    def chart(kind, **args):
+        def run():
+            data, reduced = reduce_chart(kind, state['df'], args)
+            render_chart(kind, data, dict(reduced, graph_path=os.path.join(graph_dir, f'{spec.id}_{kind}.png')), None)
+        return run
+
+    options = spec.chart
+    return [
+        ('execute', execute),
+        ('fetch', fetch),
+        ('dataframe', dataframe),
+        ('statistics', measures),
+        ('chart_bar', chart('bar', x_col=options.get('bar_x_col'), y_col=options.get('bar_y_col'), orientation=options.get('orientation'))),
+        ('chart_hist', chart('hist', column=options.get('hist_col'))),
+        ('chart_pie', chart('pie', index_col=options.get('pie_index_col'), values_col=options.get('pie_values_col'))),
+    ], state
+
+
+# seconds of each stage in one run, and the peak of python memory when trace is set
+def measure_once(conn, spec, graph_dir, trace=False, slow_log=None):
+    stages, state = run_stages(conn, spec, graph_dir, slow_log)
+    seconds = {}
+    peaks = {}
+    for name, stage in stages:
+        if trace:
+            tracemalloc.start()
+        start_time = time.perf_counter()
+        stage()
+        seconds[name] = time.perf_counter() - start_time
+        if trace:
+            peaks[name] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+    return seconds, peaks, len(state.get('rows', []))
+
+
+# median time of the repetitions; the memory is measured in a separate run because tracing slows it down
+def benchmark_query(conn, spec, graph_dir, repeat, slow_log=None):
+    runs = [measure_once(conn, spec, graph_dir, slow_log=slow_log) for _ in range(repeat)]
+    _, peaks, rows = measure_once(conn, spec, graph_dir, trace=True)
+    stages = {}
+    for name in STAGES:
+        seconds = statistics.median(run[0][name] for run in runs)
+        stages[name] = {
+            'seconds': seconds,
+            'rows_per_second': rows / seconds if seconds else None,
+            'peak_bytes': peaks[name],
+        }
+    return {'id': spec.id, 'title': spec.title, 'rows': rows, 'stages': stages}
+
+
+# median seconds of the runs of a function, and what it returned the last time
+def timed(function, repeat):
+    runs = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        result = function()
+        runs.append(time.perf_counter() - start_time)
+    return statistics.median(runs), result
+
+
+# the exact count(distinct ...) against the local sketch (sqlite has no approx_count_distinct),
+# in time and in the relative error of the counts of the groups that are in both results
+def benchmark_approx(conn, spec, repeat, precision=DEFAULT_PRECISION):
+    def exact():
+        cursor = conn.cursor()
+        cursor.execute(spec.sql)
+        filas = [tuple(fila) for fila in cursor.fetchall()]
+        cursor.close()
+        return filas
+
+    plan = sketch_plan(spec.sql, spec.metric_column)
+    exact_seconds, exact_rows = timed(exact, repeat)
+    approx_seconds, (_, approx_rows) = timed(lambda: count_with_sketch(conn.cursor(), plan, precision=precision), repeat)
+    reales = {fila[:-1]: fila[-1] for fila in exact_rows}
+    errores = [abs(fila[-1] - reales[fila[:-1]]) / reales[fila[:-1]] for fila in approx_rows if reales.get(fila[:-1])]
+    return {
+        'id': spec.id,
+        'exact_seconds': exact_seconds,
+        'approx_seconds': approx_seconds,
+        'speedup': exact_seconds / approx_seconds if approx_seconds else None,
+        'groups': len(approx_rows),
+        'groups_compared': len(errores),
+        'max_error': max(errores, default=0.0),
+        'mean_error': statistics.mean(errores) if errores else 0.0,
+        'error_bound': sketch_error(precision),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(database, scale, repeat, ids=None, regenerate=False, approx=False, precision=DEFAULT_PRECISION, slow_log=None):
+    if regenerate or not os.path.exists(database):
+        standin.generate(database, scale=scale)
+    specs = [spec for spec in list_specs() if not ids or spec.id in ids]
+    results = []
+    with standin.connect(database) as conn, tempfile.TemporaryDirectory() as graph_dir:
+        sizes = standin.table_sizes(conn)
+        for spec in specs:
+            result = benchmark_query(conn, spec, graph_dir, repeat, slow_log)
+            total = sum(stage['seconds'] for stage in result['stages'].values())
+            print(f"{spec.id:>3} {result['rows']:>7} filas {total:8.3f} s  " +
+                  '  '.join(f"{name}={stage['seconds']:.3f}" for name, stage in result['stages'].items()))
+            results.append(result)
+        aproximados = []
+        if approx:
+            for spec in specs:
+                if not spec.approximable:
+                    continue
+                result = benchmark_approx(conn, spec, repeat, precision)
+                print(f"{spec.id:>3} exacto {result['exact_seconds']:.3f} s  aproximado {result['approx_seconds']:.3f} s  "
+                      f"error máximo {result['max_error']:.2%} (medio {result['mean_error']:.2%}, {result['groups_compared']} grupos, "
+                      f"límite {result['error_bound']:.2%})")
+                aproximados.append(result)
+    return {
+        'commit': current_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': database,
+        'scale': scale,
+        'sizes': sizes,
+        'repeat': repeat,
+        'queries': results,
+        'approximate': aproximados,
+    }
+
+
+# time of each stage of a result against a previous one, >1 means slower
+def compare(old_path, new_path):
+    with open(old_path, encoding='utf-8') as file:
+        old = {query['id']: query for query in json.load(file)['queries']}
+    with open(new_path, encoding='utf-8') as file:
+        new = json.load(file)['queries']
+    for query in new:
+        before = old.get(query['id'])
+        if before is None:
+            continue
+        ratios = []
+        for name, stage in query['stages'].items():
+            previous = before['stages'].get(name, {}).get('seconds')
+            if previous:
+                ratios.append(f"{name}={stage['seconds'] / previous:.2f}x")
+        print(f"{query['id']:>3} " + '  '.join(ratios))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the registered queries over a synthetic aribus380 database')
+    parser.add_argument('--database', default='bench.db', help='sqlite file of the stand-in database')
+    parser.add_argument('--scale', type=float, default=1.0, help='scale factor of the generated tables')
+    parser.add_argument('--regenerate', action='store_true', help='generate the database again even if it exists')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each query, the median is reported')
+    parser.add_argument('--ids', type=int, nargs='*', help='only these queries')
+    parser.add_argument('--queries-file', help='json file with extra queries, like QUERIES_FILE')
+    parser.add_argument('--approx', action='store_true', help='also compare the exact distinct counts with the approximate ones')
+    parser.add_argument('--approx-precision', type=int, default=DEFAULT_PRECISION, help='precision of the sketch, like APPROX_PRECISION')
+    parser.add_argument('--slow-query-seconds', type=float, default=0, help='write the executions slower than this to the slow query log, like SLOW_QUERY_SECONDS')
+    parser.add_argument('--slow-query-log', default='slow_queries.log', help='file of the slow query log, like SLOW_QUERY_LOG')
+    parser.add_argument('--output', default=f"bench_{datetime.now():%Y%m%d_%H%M%S}.json", help='json file with the results')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+    if args.queries_file:
+        load_queries_file(args.queries_file)
+    slow_log = SlowQueryLog(args.slow_query_log, args.slow_query_seconds) if args.slow_query_seconds else None
+    results = run(args.database, args.scale, args.repeat, ids=args.ids, regenerate=args.regenerate,
+                  approx=args.approx, precision=args.approx_precision, slow_log=slow_log)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    print(f'Resultados en {args.output}')
+
+
+if __name__ == '__main__':
+    main()
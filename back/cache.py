@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# result of one query: column names, rows as plain tuples, the time the database took,
+# a dict for values derived from the rows (dataframe, measures) so they are built only once,
+# when the rows come from a stored snapshot, the time it was taken and, for an approximate
+# count, how it was computed and its error
+CacheEntry = namedtuple('CacheEntry', ['columns', 'rows', 'db_time', 'created_at', 'derived', 'snapshot_at', 'approximate'], defaults=[None, None])
+
+
+# in-memory LRU cache with expiration for query results
+class ResultCache:
+    def __init__(self, max_entries=64, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() - entry.created_at > self.ttl:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    # created_at is given for a result that was computed before, by another process
+    def set(self, key, columns, rows, db_time, snapshot_at=None, approximate=None, created_at=None):
+        entry = CacheEntry(columns, rows, db_time, created_at or time.time(), {}, snapshot_at, approximate)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    # keys are (database, query id, ...); None matches everything
+    def invalidate(self, database=None, query_id=None):
+        with self._lock:
+            keys = [key for key in self._entries
+                    if (database is None or key[0] == database)
+                    and (query_id is None or key[1] == query_id)]
+            for key in keys:
+                del self._entries[key]
+        return len(keys)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
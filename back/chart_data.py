@@ -0,0 +1,67 @@
+from lazy import LazyModule
+
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+# label of the bar or slice that adds up the categories outside of the top
+OTHERS_LABEL = 'Otros'
+
+# bars and slices drawn at most (plus Otros), series of a grouped bar chart and bins of the histogram
+BAR_TOP_N = 15
+PIE_TOP_N = 8
+MAX_SERIES = 6
+HIST_BINS = 10
+
+
+# column that splits the bars in groups (like the year in Estado + año): another key that changes
+# inside a label and has few values; the columns that only describe the label (the city of an
+# airport) are not keys, and the keys with many values (the municipios of an estado) are added up
+def series_column(df, label_col, value_col, max_series=MAX_SERIES):
+    keys = [column for column in df.columns if column not in (label_col, value_col)]
+    keys = [column for column in keys if df.groupby(label_col, sort=False)[column].nunique().max() > 1]
+    if not keys:
+        return None
+    column = min(keys, key=lambda key: df[key].nunique())
+    return column if df[column].nunique() <= max_series else None
+
+
+# value of each label (and series), with the labels outside of the top_n largest added up in Otros;
+# when nothing is cut the labels keep the order of the query, otherwise they go from the largest
+def top_n_with_others(df, label_col, value_col, top_n, series=None):
+    keys = [label_col] + ([series] if series else [])
+    frame = df.groupby(keys, sort=False, dropna=False)[value_col].sum().reset_index()
+    frame[keys] = frame[keys].astype(str)
+    totals = frame.groupby(label_col, sort=False)[value_col].sum()
+    if len(totals) <= top_n:
+        return frame
+    keep = totals.nlargest(top_n).index
+    frame[label_col] = frame[label_col].where(frame[label_col].isin(keep), OTHERS_LABEL)
+    frame = frame.groupby(keys, sort=False)[value_col].sum().reset_index()
+    order = {label: position for position, label in enumerate(list(keep) + [OTHERS_LABEL])}
+    return frame.sort_values(label_col, key=lambda labels: labels.map(order), kind='stable').reset_index(drop=True)
+
+
+def bar_data(df, x_col, y_col, top_n=BAR_TOP_N, max_series=MAX_SERIES):
+    series = series_column(df, x_col, y_col, max_series)
+    return top_n_with_others(df, x_col, y_col, top_n, series), series
+
+
+def pie_data(df, index_col, values_col, top_n=PIE_TOP_N):
+    return top_n_with_others(df, index_col, values_col, top_n)
+
+
+# bins of the histogram computed here, the worker only draws the bars
+def hist_data(df, column, bins=HIST_BINS):
+    values = pd.to_numeric(df[column], errors='coerce').dropna().to_numpy()
+    counts, edges = np.histogram(values, bins=bins)
+    return pd.DataFrame({'desde': edges[:-1], 'hasta': edges[1:], 'frecuencia': counts})
+
+
+# data and arguments of one graph of CHARTS after the reduction; the bar chart gets its series as hue
+def reduce_chart(kind, df, args, bar_top_n=BAR_TOP_N, pie_top_n=PIE_TOP_N, max_series=MAX_SERIES, hist_bins=HIST_BINS):
+    if kind == 'bar':
+        data, hue = bar_data(df, args['x_col'], args['y_col'], bar_top_n, max_series)
+        return data, dict(args, hue=hue)
+    if kind == 'pie':
+        return pie_data(df, args['index_col'], args['values_col'], pie_top_n), args
+    return hist_data(df, args['column'], hist_bins), args
@@ -0,0 +1,212 @@
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from graph_files import save_figure
+from lazy import LazyModule
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+    #the svg keeps the text as text instead of a path for every letter, the files are much smaller
+    matplotlib.rcParams['svg.fonttype'] = 'none'
+
+
+# matplotlib and seaborn take seconds to import, they are loaded by the first graph
+plt = LazyModule('matplotlib.pyplot', before_import=_use_agg)
+sns = LazyModule('seaborn', before_import=_use_agg)
+
+
+class ChartQueueFull(Exception):
+    pass
+
+
+# size in inches and dpi of the graphs; carousel fills the carousel of query.html (800x450 px)
+CHART_PRESETS = {
+    'carousel': {'size': (8, 4.5), 'dpi': 100},
+    'compact': {'size': (6.4, 3.6), 'dpi': 80},
+    'print': {'size': (10, 5.625), 'dpi': 150},
+}
+
+# bars and slices above this are drawn as an image, an svg with thousands of shapes is heavier
+SVG_MAX_ITEMS = 60
+
+
+# format of a graph: auto uses svg for small bar and pie charts and webp for the rest
+def choose_format(kind, items, preference='auto'):
+    if preference != 'auto':
+        return preference
+    if kind in ('bar', 'pie') and items <= SVG_MAX_ITEMS:
+        return 'svg'
+    return 'webp'
+
+
+def _current_figure(size):
+    fig = plt.gcf()
+    if size:
+        fig.set_size_inches(size)
+    return fig
+
+
+#function to create graphys; the data comes already reduced by chart_data, one bar for each label (and series)
+def generate_bar_chart(df, x_col, y_col, graph_path,orientation, hue=None, fmt='png', size=None, dpi=None):
+    fig = _current_figure(size)
+    sns.barplot(x=x_col, y=y_col, hue=hue, data=df)
+    if hue:
+        plt.legend(title=hue, fontsize=8, title_fontsize=8)
+
+    plt.xticks(fontsize=8,rotation=orientation)
+    plt.title('Gráfico de Barras', fontsize=14)
+    plt.xlabel(x_col, fontsize=12)
+    plt.ylabel(y_col, fontsize=12)
+    plt.tight_layout()
+    save_figure(fig, graph_path, fmt, dpi)
+    plt.clf()
+
+# df has the bins of chart_data.hist_data (desde, hasta, frecuencia), not the values
+def generate_histogram(df, column, graph_path, fmt='png', size=None, dpi=None):
+    fig, ax = plt.subplots(figsize=size)
+    ax.bar(df['desde'], df['frecuencia'], width=df['hasta'] - df['desde'], align='edge', linewidth=0.5, edgecolor="white")
+    ax.set_title('Histograma')
+    ax.set_xlabel(column, fontsize=10)
+    ax.set_ylabel('Frequency')
+    save_figure(fig, graph_path, fmt, dpi)
+    plt.close(fig)
+
+def generate_pie_chart(df, index_col, values_col, graph_path, fmt='png', size=None, dpi=None):
+    fig = _current_figure(size)
+    df.set_index(index_col)[values_col].plot.pie()
+    plt.title('Gráfico de pastel')
+    plt.ylabel('')
+    save_figure(fig, graph_path, fmt, dpi)
+    plt.clf()
+
+CHARTS = {
+    'bar': generate_bar_chart,
+    'hist': generate_histogram,
+    'pie': generate_pie_chart,
+}
+
+
+def _on_timeout(signum, frame):
+    raise TimeoutError('El gráfico tardó demasiado en generarse')
+
+
+# runs inside a worker process, the alarm stops a render that takes longer than the timeout
+def render_chart(kind, df, args, timeout):
+    use_alarm = timeout and hasattr(signal, 'SIGALRM')
+    if use_alarm:
+        signal.signal(signal.SIGALRM, _on_timeout)
+        signal.alarm(int(timeout))
+    try:
+        CHARTS[kind](df, **args)
+    except BaseException:
+        plt.close('all')
+        raise
+    finally:
+        if use_alarm:
+            signal.alarm(0)
+    return args['graph_path']
+
+
+# render a graph and return its path with the seconds it took inside the worker
+def render_chart_timed(kind, df, args, timeout):
+    start_time = time.perf_counter()
+    graph_path = render_chart(kind, df, args, timeout)
+    return graph_path, time.perf_counter() - start_time
+
+
+# load the fonts and the plotting code (pyplot and seaborn) once in each worker, before the first request
+def warm_worker():
+    sns.load()
+    fig, ax = plt.subplots()
+    ax.set_title('warmup')
+    fig.canvas.draw()
+    plt.close(fig)
+
+
+# renders the graphs in a pool of processes, every worker has its own pyplot state;
+# on_rendered(kind, query_id, seconds) is called when a graph is ready
+class ChartRenderer:
+    def __init__(self, workers=2, queue_limit=32, timeout=60, on_rendered=None):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.on_rendered = on_rendered
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker)
+        return self._executor
+
+    # send a graph to the pool, a graph already in the queue is not sent again
+    def submit(self, kind, df, query_id=None, **args):
+        graph_path = os.path.abspath(args['graph_path'])
+        with self._lock:
+            self._prune()
+            current = self._futures.get(graph_path)
+            if current is not None and not current[0].done():
+                return current[0]
+            if self.workers <= 0:
+                future = Future()
+                try:
+                    future.set_result(render_chart_timed(kind, df, args, None))
+                except Exception as ex:
+                    future.set_exception(ex)
+            elif self.pending() >= self.queue_limit:
+                future = Future()
+                future.set_exception(ChartQueueFull('Demasiados gráficos en espera, intente de nuevo'))
+            else:
+                future = self._get_executor().submit(render_chart_timed, kind, df, args, self.timeout)
+            if self.on_rendered is not None:
+                future.add_done_callback(lambda done: self._rendered(kind, query_id, done))
+            self._futures[graph_path] = (future, time.time())
+            return future
+
+    def _rendered(self, kind, query_id, future):
+        if not future.cancelled() and future.exception() is None:
+            self.on_rendered(kind, query_id, future.result()[1])
+
+    def pending(self):
+        return sum(1 for future, _ in self._futures.values() if not future.done())
+
+    # ready, pending or error for a graph; a graph without a future is ready if its file exists
+    def status(self, graph_path):
+        graph_path = os.path.abspath(graph_path)
+        with self._lock:
+            current = self._futures.get(graph_path)
+        if current is None:
+            return ('ready', None) if os.path.exists(graph_path) else ('missing', None)
+        future, submitted_at = current
+        if not future.done():
+            if time.time() - submitted_at > self.timeout * 2:
+                return 'error', 'El gráfico tardó demasiado en generarse'
+            return 'pending', None
+        error = future.exception()
+        if error is not None:
+            return 'error', str(error)
+        return 'ready', None
+
+    # forget finished graphs after a while, their files are enough to know they are ready
+    def _prune(self):
+        now = time.time()
+        for graph_path, (future, submitted_at) in list(self._futures.items()):
+            if future.done() and now - submitted_at > self.timeout * 2:
+                del self._futures[graph_path]
+
+    # start the worker processes before the first graph, each one loads the plotting code
+    def warm_up(self):
+        if self.workers > 0:
+            executor = self._get_executor()
+            for _ in range(self.workers):
+                executor.submit(warm_worker)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
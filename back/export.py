@@ -0,0 +1,136 @@
+import csv
+import datetime
+import decimal
+import importlib.util
+import io
+
+from lazy import LazyModule
+
+# pyarrow is optional, without it only csv can be exported
+pa = LazyModule('pyarrow')
+pq = LazyModule('pyarrow.parquet')
+ARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+# media type and extension of each format; parquet and arrow are compressed inside the file,
+# csv is compressed by the response
+EXPORT_FORMATS = {
+    'csv': {'mimetype': 'text/csv', 'extension': 'csv', 'arrow': False},
+    'parquet': {'mimetype': 'application/vnd.apache.parquet', 'extension': 'parquet', 'arrow': True},
+    'arrow': {'mimetype': 'application/vnd.apache.arrow.stream', 'extension': 'arrows', 'arrow': True},
+}
+
+
+def available_formats():
+    return [name for name, formato in EXPORT_FORMATS.items() if ARROW_AVAILABLE or not formato['arrow']]
+
+
+# rows of a cached result in batches, the same shape as the ones read from the cursor
+def batches_of(rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+# csv with a header, one chunk of text per batch
+def csv_chunks(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for filas in batches:
+        writer.writerows(filas)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+# file object that gives what is written as chunks, keeping the position the writers ask for
+class _Drain(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+# arrow type of a column of cursor.description: the python type the driver gives, with
+# the precision and scale of the decimals
+def _arrow_type(column):
+    type_code, precision, scale = column[1], column[4], column[5]
+    if type_code is decimal.Decimal and precision:
+        return pa.decimal128(precision, scale or 0)
+    return {
+        int: pa.int64(),
+        float: pa.float64(),
+        bool: pa.bool_(),
+        str: pa.string(),
+        datetime.date: pa.date32(),
+        datetime.datetime: pa.timestamp('us'),
+        bytes: pa.binary(),
+    }.get(type_code)
+
+
+# schema from the description of the cursor, the columns without a known type are inferred from the first batch
+def _schema(columns, description, filas):
+    fields = []
+    for index, name in enumerate(columns):
+        tipo = _arrow_type(description[index]) if description else None
+        if tipo is None:
+            tipo = pa.array([fila[index] for fila in filas]).type
+            if pa.types.is_null(tipo):
+                tipo = pa.string()
+        fields.append(pa.field(name, tipo))
+    return pa.schema(fields)
+
+
+def _record_batch(schema, filas):
+    return pa.record_batch([pa.array([fila[index] for fila in filas], type=field.type) for index, field in enumerate(schema)], schema=schema)
+
+
+# the whole result as one arrow table, for the shared store of results
+def arrow_table(columns, rows, description=None):
+    schema = _schema(columns, description, rows)
+    return pa.Table.from_batches([_record_batch(schema, rows)], schema=schema)
+
+
+def _writer(sink, schema, formato):
+    if formato == 'parquet':
+        return pq.ParquetWriter(sink, schema, compression='zstd')
+    return pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+
+
+# parquet (one row group per batch) or arrow ipc stream, each batch is sent as soon as it is written
+def arrow_chunks(columns, batches, formato, description=None):
+    sink = _Drain()
+    writer = None
+    for filas in batches:
+        if writer is None:
+            schema = _schema(columns, description, filas)
+            writer = _writer(sink, schema, formato)
+        writer.write_batch(_record_batch(schema, filas))
+        yield sink.drain()
+    if writer is None:
+        writer = _writer(sink, _schema(columns, description, []), formato)
+    writer.close()
+    yield sink.drain()
+
+
+def export_chunks(columns, batches, formato, description=None):
+    if EXPORT_FORMATS[formato]['arrow']:
+        return arrow_chunks(columns, batches, formato, description)
+    return csv_chunks(columns, batches)
@@ -0,0 +1,203 @@
+import threading
+import time
+
+from lazy import LazyModule
+
+# pandas and numpy are loaded by the first extraction
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+# one row for each occupation of a client, with the columns the passenger reports need;
+# the left join keeps the occupations without flight detail, only the reports by date drop them
+FACTS_SQL = '''
+    select o.cve_clientes, c.cve_estados, c.cve_municipios, year(c.fecha_nacimiento),
+    year(dv.fecha_hora_salida), month(dv.fecha_hora_salida),
+    case when dv.cve_detalle_vuelos is null then 0 else 1 end
+    from ocupaciones as o
+    join clientes as c on o.cve_clientes = c.cve_clientes
+    left join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
+'''
+FACT_COLUMNS = ['cve_clientes', 'cve_estados', 'cve_municipios', 'año_nacimiento', 'año', 'mes', 'con_vuelo']
+
+ESTADOS_SQL = 'select cve_estados, nombre from estados'
+MUNICIPIOS_SQL = 'select cve_municipios, nombre, cve_estados from municipios'
+# names of the months in the language of the server, as datename returns them
+MESES_SQL = '''
+    select distinct month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida)
+    from detalle_vuelos as dv
+    where dv.fecha_hora_salida is not null
+'''
+HOY_SQL = 'select year(getdate())'
+
+
+# facts of one database: the occupations as integer columns and the names as small lookup tables
+class Facts:
+    def __init__(self, facts, estados, municipios, meses, año_actual):
+        self.facts = facts
+        self.estados = estados
+        self.municipios = municipios
+        self.meses = meses
+        self.año_actual = año_actual
+        self.created_at = time.time()
+
+
+# integer columns with the smallest type that holds them; with nulls they use the nullable types
+def _compact(frame):
+    for column in frame.columns:
+        values = pd.to_numeric(frame[column], errors='coerce')
+        if values.isna().any():
+            frame[column] = values.astype('Int64')
+        else:
+            frame[column] = pd.to_numeric(values, downcast='integer')
+    return frame
+
+
+# read the facts in batches, each batch is converted to compact columns before reading the next
+def extract_facts(conn, batch_size=50000):
+    cursor = conn.cursor()
+    cursor.execute(FACTS_SQL)
+    partes = []
+    while True:
+        filas = cursor.fetchmany(batch_size)
+        if not filas:
+            break
+        partes.append(_compact(pd.DataFrame.from_records([tuple(fila) for fila in filas], columns=FACT_COLUMNS)))
+    facts = pd.concat(partes, ignore_index=True) if partes else _compact(pd.DataFrame(columns=FACT_COLUMNS))
+    facts['con_vuelo'] = facts['con_vuelo'].astype(bool)
+
+    cursor.execute(ESTADOS_SQL)
+    estados = pd.DataFrame.from_records([tuple(fila) for fila in cursor.fetchall()], columns=['cve_estados', 'nombre_estado'])
+    cursor.execute(MUNICIPIOS_SQL)
+    municipios = pd.DataFrame.from_records([tuple(fila) for fila in cursor.fetchall()], columns=['cve_municipios', 'nombre_municipio', 'cve_estados'])
+    cursor.execute(MESES_SQL)
+    meses = {int(mes): nombre for mes, nombre in cursor.fetchall()}
+    cursor.execute(HOY_SQL)
+    año_actual = int(cursor.fetchone()[0])
+    cursor.close()
+
+    estados['nombre_estado'] = estados['nombre_estado'].astype('category')
+    municipios['nombre_municipio'] = municipios['nombre_municipio'].astype('category')
+    return Facts(facts, estados, municipios, meses, año_actual)
+
+
+# join by key like an inner join of sql server: null keys never match
+def _join(left, right, on):
+    left = left[left[on].notna()].astype({on: 'int64'})
+    right = right[right[on].notna()].astype({on: 'int64'})
+    return left.merge(right, on=on, how='inner')
+
+
+def _rows(frame):
+    return [tuple(None if pd.isna(valor) else (valor.item() if hasattr(valor, 'item') else valor) for valor in fila)
+            for fila in frame.itertuples(index=False, name=None)]
+
+
+def personas_por_estado(facts):
+    datos = _join(facts.facts, facts.estados, 'cve_estados')
+    conteo = datos.groupby('nombre_estado', observed=True).size().sort_values(ascending=False, kind='stable')
+    return ['Estados', 'Número_de_personas_que_viajaron'], _rows(conteo.reset_index())
+
+
+def personas_por_estado_año(facts):
+    datos = _join(facts.facts[facts.facts['con_vuelo']], facts.estados, 'cve_estados')
+    conteo = datos.groupby(['nombre_estado', 'año'], observed=True, dropna=False)['cve_clientes'].nunique()
+    return ['Estado', 'año', 'Número_personas_que_viajaron'], _rows(conteo.reset_index())
+
+
+CATEGORIAS = ['Niños hasta 12 años', 'Adolescentes de 13 a 17 años', 'Jóvenes de 18 a 30 años',
+              'Adultos de 31 a 59 años', 'Adultos mayores de 60 años']
+
+
+# same case as the sql: datediff(year) only compares the years and a null birth date falls in the else
+def personas_por_categoria(facts):
+    datos = facts.facts[['cve_clientes', 'año_nacimiento']]
+    edad = (facts.año_actual - datos['año_nacimiento'].astype('float64')).to_numpy()
+    categoria = np.select(
+        [edad <= 12, (edad >= 13) & (edad <= 17), (edad >= 18) & (edad <= 30), (edad >= 31) & (edad <= 59)],
+        CATEGORIAS[:4], default=CATEGORIAS[4])
+    conteo = datos.assign(categoria=categoria).groupby('categoria')['cve_clientes'].nunique()
+    return ['Categoría_de_edad', 'número_de_personas'], _rows(conteo.reset_index())
+
+
+def top_estados(facts):
+    datos = _join(facts.facts, facts.estados, 'cve_estados')
+    conteo = datos.groupby('nombre_estado', observed=True)['cve_clientes'].nunique()
+    conteo = conteo.sort_values(ascending=False, kind='stable').head(10)
+    return ['Estado', 'Número_de_personas'], _rows(conteo.reset_index())
+
+
+def personas_por_año(facts):
+    datos = facts.facts[facts.facts['con_vuelo']]
+    conteo = datos.groupby('año', dropna=False).size()
+    return ['Número_de_personas', 'Año'], _rows(conteo.reset_index()[[0, 'año']])
+
+
+def personas_por_mes(facts):
+    datos = facts.facts[facts.facts['con_vuelo']]
+    conteo = datos.groupby('mes', dropna=False)['cve_clientes'].nunique().reset_index()
+    conteo['mes'] = conteo['mes'].map(lambda mes: None if pd.isna(mes) else facts.meses.get(int(mes)))
+    return ['Mes', 'Número_de_personas'], _rows(conteo)
+
+
+# municipios with the estado of the municipio (not the one of the client), like queries 14 and 15
+def _personas_por_municipio(facts):
+    municipios = _join(facts.municipios, facts.estados, 'cve_estados')
+    datos = _join(facts.facts[['cve_clientes', 'cve_municipios']], municipios, 'cve_municipios')
+    return datos.groupby(['nombre_municipio', 'nombre_estado'], observed=True)['cve_clientes'].nunique()
+
+
+def top_municipios(facts):
+    conteo = _personas_por_municipio(facts).sort_values(ascending=False, kind='stable').head(10)
+    return ['Municipio', 'Estado', 'Número_de_personas'], _rows(conteo.reset_index())
+
+
+def municipios_con_menos_personas(facts):
+    conteo = _personas_por_municipio(facts).sort_values(ascending=True, kind='stable').head(10)
+    return ['Municipio', 'Estado', 'Número_de_personas'], _rows(conteo.reset_index())
+
+
+REPORTS = {
+    'personas_por_estado': personas_por_estado,
+    'personas_por_estado_año': personas_por_estado_año,
+    'personas_por_categoria': personas_por_categoria,
+    'top_estados': top_estados,
+    'personas_por_año': personas_por_año,
+    'personas_por_mes': personas_por_mes,
+    'top_municipios': top_municipios,
+    'municipios_con_menos_personas': municipios_con_menos_personas,
+}
+
+
+# facts of each database kept in memory for ttl seconds; only one extraction at a time per database
+class FactStore:
+    def __init__(self, ttl=3600):
+        self.ttl = ttl
+        self._facts = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, database, connect, timeout=None):
+        with self._lock:
+            lock = self._locks.setdefault(database, threading.Lock())
+        with lock:
+            facts = self._facts.get(database)
+            if facts is None or time.time() - facts.created_at > self.ttl:
+                with connect() as conn:
+                    #the time limit of the query that asked first applies to the whole extraction
+                    conn.timeout = timeout or 0
+                    try:
+                        facts = extract_facts(conn)
+                    finally:
+                        conn.timeout = 0
+                self._facts[database] = facts
+            return facts
+
+    def invalidate(self, database=None):
+        with self._lock:
+            if database is None:
+                self._facts.clear()
+            else:
+                self._facts.pop(database, None)
+
+    def compute(self, database, report, connect, timeout=None):
+        return REPORTS[report](self.get(database, connect, timeout))
@@ -0,0 +1,70 @@
+import re
+from datetime import date, timedelta
+
+# filters a report can accept and the parameters of the query string or the form that give them;
+# the date range has two, both optional and both inclusive
+FILTER_PARAMS = {
+    'fecha': ('desde', 'hasta'),
+    'estado': ('estado',),
+    'aerolinea': ('aerolinea',),
+    'aeropuerto': ('aeropuerto',),
+}
+
+
+class InvalidFilter(ValueError):
+    pass
+
+
+def _date(param, value):
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise InvalidFilter(f'Fecha no válida en {param}: {value} (debe ser AAAA-MM-DD)') from None
+
+
+# values of the filters in the request, only of the ones the report accepts; the empty ones are not applied
+def parse_filters(accepted, values):
+    filtros = {}
+    for name, params in FILTER_PARAMS.items():
+        for param in params:
+            value = (values.get(param) or '').strip()
+            if not value:
+                continue
+            if name not in accepted:
+                raise InvalidFilter(f'La consulta no acepta el filtro {param}')
+            filtros[param] = _date(param, value) if name == 'fecha' else value
+    if 'desde' in filtros and 'hasta' in filtros and filtros['desde'] > filtros['hasta']:
+        raise InvalidFilter('La fecha desde es posterior a la fecha hasta')
+    return filtros
+
+
+# predicates over the columns of the report with a placeholder for each value; the dates compare the
+# column itself with the start of desde and the start of the day after hasta, so an index on it is used
+def filter_predicates(columns, filtros):
+    predicates, params = [], []
+    if 'desde' in filtros:
+        predicates.append(f"{columns['fecha']} >= ?")
+        params.append(filtros['desde'])
+    if 'hasta' in filtros:
+        predicates.append(f"{columns['fecha']} < ?")
+        params.append(filtros['hasta'] + timedelta(days=1))
+    for name in ('estado', 'aerolinea', 'aeropuerto'):
+        if name in filtros:
+            predicates.append(f'{columns[name]} = ?')
+            params.append(filtros[name])
+    return predicates, params
+
+
+# the predicates go before the group by (or the order by) of the report; a report with its own
+# where gets them after it with an and, so that where must be in parentheses if it has an or
+def add_where(sql, predicates):
+    matches = list(re.finditer(r'\bgroup\s+by\b', sql, re.IGNORECASE)) or list(re.finditer(r'\border\s+by\b', sql, re.IGNORECASE))
+    position = matches[-1].start() if matches else len(sql.rstrip())
+    head = sql[:position].rstrip()
+    keyword = 'and' if re.search(r'\bwhere\b', head, re.IGNORECASE) else 'where'
+    return f"{head}\n            {keyword} {' and '.join(predicates)}\n            {sql[position:]}"
+
+
+# part of the cache key of a filtered result, the same filters give the same key in any order
+def filter_key(filtros):
+    return tuple(f'{param}={value}' for param, value in sorted(filtros.items()))
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import threading
+import time
+
+from lazy import LazyModule
+
+pd = LazyModule('pandas')
+
+
+# hash of the dataframe contents and the plot parameters, used to name the graph files
+def chart_digest(df, **params):
+    digest = hashlib.sha1()
+    digest.update(repr(list(df.columns)).encode('utf-8'))
+    digest.update(repr([str(dtype) for dtype in df.dtypes]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    digest.update(repr(sorted(params.items())).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+# True when the graph was already rendered, refreshing its age so the sweeper keeps it
+def graph_is_fresh(graph_path):
+    try:
+        os.utime(graph_path)
+        return True
+    except OSError:
+        return False
+
+
+# options of each format: png is written by pillow with optimize, webp with lossy compression
+# good enough for charts, and svg without the date so the same graph gives the same file
+SAVE_OPTIONS = {
+    'png': {'pil_kwargs': {'optimize': True}},
+    'webp': {'pil_kwargs': {'quality': 80, 'method': 4}},
+    'svg': {'metadata': {'Date': None}},
+}
+
+
+# write to a temporary file and rename, so a reader never sees a half written image
+def save_figure(fig, graph_path, fmt='png', dpi=None):
+    tmp_path = f"{graph_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        fig.savefig(tmp_path, format=fmt, dpi=dpi or 'figure', **SAVE_OPTIONS.get(fmt, {}))
+        os.replace(tmp_path, graph_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+# delete old graph files, first by age and then the oldest until the folder fits in max_bytes
+class GraphSweeper:
+    def __init__(self, graph_dir, max_age=24 * 3600, max_bytes=200 * 1024 * 1024, interval=300):
+        self.graph_dir = graph_dir
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.interval = interval
+        self._last_run = 0.0
+        self._lock = threading.Lock()
+
+    # run the sweep only if the interval has passed since the last one
+    def maybe_sweep(self):
+        now = time.time()
+        if now - self._last_run < self.interval or not self._lock.acquire(blocking=False):
+            return 0
+        try:
+            self._last_run = now
+            return self.sweep()
+        finally:
+            self._lock.release()
+
+    def sweep(self):
+        now = time.time()
+        files = []
+        for entry in os.scandir(self.graph_dir) if os.path.isdir(self.graph_dir) else []:
+            if entry.is_file():
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+
+        removed = 0
+        total = sum(size for _, size, _ in files)
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+                total -= size
+            except OSError:
+                pass
+        return removed
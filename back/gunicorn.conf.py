@@ -0,0 +1,43 @@
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+# production server: gunicorn reads this file when it starts in back/ (gunicorn, or gunicorn -c gunicorn.conf.py);
+# its settings come from .env like the ones of the app
+load_dotenv()
+
+wsgi_app = 'wsgi:app'
+bind = os.getenv('WEB_BIND', '0.0.0.0:8000')
+
+# one process per core, each one with a few threads for the requests that wait on the database
+workers = int(os.getenv('WEB_WORKERS') or multiprocessing.cpu_count())
+worker_class = 'gthread'
+threads = int(os.getenv('WEB_THREADS', 4))
+
+# the app and its libraries are loaded once in the master and the workers are forked from it
+preload_app = os.getenv('WEB_PRELOAD', '1') == '1'
+
+# a worker is replaced after this many requests (plus a random part so they do not restart at
+# the same time), that gives back the memory matplotlib and pandas keep growing
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('WEB_MAX_REQUESTS_JITTER', 100))
+
+# a worker that does not answer in timeout seconds is restarted; on a reload or a stop the workers
+# have graceful_timeout seconds to finish their requests, more than the longest query limit
+timeout = int(os.getenv('WEB_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('WEB_GRACEFUL_TIMEOUT', 130))
+keepalive = int(os.getenv('WEB_KEEPALIVE', 5))
+
+accesslog = os.getenv('WEB_ACCESS_LOG')
+errorlog = os.getenv('WEB_ERROR_LOG', '-')
+
+
+def post_worker_init(worker):
+    import wsgi
+    wsgi.worker_started()
+
+
+def worker_exit(server, worker):
+    import wsgi
+    wsgi.worker_stopping()
@@ -0,0 +1,192 @@
+import sqlite3
+import threading
+
+# watermark before the first refresh, below any key of the tables
+FIRST_WATERMARK = -1
+
+
+# partial aggregates by (year, month) of detalle_vuelos; the delta query returns year, month,
+# month name, key, value (or member when distinct) and the largest key of the rows of the group,
+# only for the rows with a key after the watermark. The watermark is the key of the table that
+# gets the rows (cve_detalle_vuelos, cve_ocupaciones), which only grows: an occupation added
+# later to a flight of a month already aggregated, or a flight loaded with an older date, is
+# still read once and added to its month
+class Aggregation:
+    def __init__(self, name, delta_sql, distinct=False):
+        self.name = name
+        self.delta_sql = delta_sql
+        self.distinct = distinct
+
+
+# report computed over the stored aggregates with a query on the local store
+class IncrementalReport:
+    def __init__(self, aggregation, result_sql):
+        self.aggregation = aggregation
+        self.result_sql = result_sql
+
+
+AGGREGATIONS = {aggregation.name: aggregation for aggregation in [
+    Aggregation('vuelos', '''
+        select year(dv.fecha_hora_salida), month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida), '',
+        count(dv.cve_vuelos), max(dv.cve_detalle_vuelos)
+        from detalle_vuelos as dv
+        where dv.cve_detalle_vuelos > ?
+        group by year(dv.fecha_hora_salida), month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida)
+    '''),
+    Aggregation('vuelos_aerolinea', '''
+        select year(dv.fecha_hora_salida), month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida), a.nombre,
+        count(dv.cve_detalle_vuelos), max(dv.cve_detalle_vuelos)
+        from detalle_vuelos as dv
+        join vuelos as v on dv.cve_vuelos = v.cve_vuelos
+        join aerolineas as a on v.cve_aerolineas = a.cve_aerolineas
+        where dv.cve_detalle_vuelos > ?
+        group by year(dv.fecha_hora_salida), month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida), a.nombre
+    '''),
+    Aggregation('ocupaciones', '''
+        select year(dv.fecha_hora_salida), month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida), '',
+        count(o.cve_clientes), max(o.cve_ocupaciones)
+        from clientes as c
+        join ocupaciones as o on o.cve_clientes = c.cve_clientes
+        join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
+        where o.cve_ocupaciones > ?
+        group by year(dv.fecha_hora_salida), month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida)
+    '''),
+    # a distinct count can not be added between buckets, so the clients of each month are stored
+    Aggregation('clientes_mes', '''
+        select year(dv.fecha_hora_salida), month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida), '',
+        c.cve_clientes, max(o.cve_ocupaciones)
+        from clientes as c
+        join ocupaciones as o on o.cve_clientes = c.cve_clientes
+        join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
+        where o.cve_ocupaciones > ?
+        group by year(dv.fecha_hora_salida), month(dv.fecha_hora_salida), datename(month, dv.fecha_hora_salida), c.cve_clientes
+    ''', distinct=True),
+]}
+
+REPORTS = {
+    'vuelos_por_año': IncrementalReport('vuelos', '''
+        select year as Año, sum(value) as Número_de_vuelos
+        from buckets where database = ? and aggregation = 'vuelos'
+        group by year
+    '''),
+    'vuelos_por_mes_año': IncrementalReport('vuelos', '''
+        select month_name as Mes, year as Año, sum(value) as Número_de_vuelos
+        from buckets where database = ? and aggregation = 'vuelos'
+        group by year, month, month_name
+    '''),
+    'vuelos_por_aerolinea_año': IncrementalReport('vuelos_aerolinea', '''
+        select key as Aerolíneas, year as Año, sum(value) as Número_de_vuelos
+        from buckets where database = ? and aggregation = 'vuelos_aerolinea'
+        group by key, year
+    '''),
+    'personas_por_año': IncrementalReport('ocupaciones', '''
+        select sum(value) as Número_de_personas, year as Año
+        from buckets where database = ? and aggregation = 'ocupaciones'
+        group by year
+    '''),
+    'personas_por_mes': IncrementalReport('clientes_mes', '''
+        select month_name as Mes, count(distinct member) as Número_de_personas
+        from members where database = ? and aggregation = 'clientes_mes'
+        group by month_name
+    '''),
+}
+
+
+# local sqlite store with the aggregates of each (year, month) and the watermark of each aggregation
+class IncrementalStore:
+    def __init__(self, path):
+        self.path = path
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('pragma journal_mode=wal')
+            conn.executescript('''
+                create table if not exists watermarks (
+                    database text, aggregation text, watermark text,
+                    primary key (database, aggregation)
+                );
+                create table if not exists buckets (
+                    database text, aggregation text, year integer, month integer, month_name text, key text, value integer,
+                    primary key (database, aggregation, year, month, key)
+                );
+                create table if not exists members (
+                    database text, aggregation text, year integer, month integer, month_name text, key text, member text,
+                    primary key (database, aggregation, year, month, key, member)
+                );
+            ''')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _lock(self, database, aggregation):
+        with self._locks_lock:
+            return self._locks.setdefault((database, aggregation), threading.Lock())
+
+    @staticmethod
+    def _read_watermark(conn, database, aggregation):
+        fila = conn.execute('select watermark from watermarks where database = ? and aggregation = ?',
+                            (database, aggregation)).fetchone()
+        if fila is None:
+            return None
+        try:
+            return int(fila[0])
+        except ValueError:
+            #a date of the first version of the store, kept as text so its aggregates are read again
+            return fila[0]
+
+    def watermark(self, database, aggregation):
+        with self._connect() as conn:
+            return self._read_watermark(conn, database, aggregation)
+
+    # bring only the rows after the watermark and add them to their buckets; execute(sql, params) returns the rows
+    def refresh(self, database, aggregation_name, execute):
+        aggregation = AGGREGATIONS[aggregation_name]
+        with self._lock(database, aggregation_name):
+            watermark = self.watermark(database, aggregation_name)
+            filas = execute(aggregation.delta_sql, [watermark if isinstance(watermark, int) else FIRST_WATERMARK])
+            if not filas:
+                return 0
+            with self._connect() as conn:
+                #another process (a gunicorn worker) can refresh the same aggregation; the write lock is
+                #taken first and the rows are skipped if the watermark moved while they were read
+                conn.execute('begin immediate')
+                if self._read_watermark(conn, database, aggregation_name) != watermark:
+                    return 0
+                if isinstance(watermark, str):
+                    for table in ('buckets', 'members'):
+                        conn.execute(f'delete from {table} where database = ? and aggregation = ?', (database, aggregation_name))
+                if aggregation.distinct:
+                    conn.executemany('''
+                        insert or ignore into members (database, aggregation, year, month, month_name, key, member)
+                        values (?, ?, ?, ?, ?, ?, ?)
+                    ''', [(database, aggregation_name, year, month, month_name, key, str(member))
+                          for year, month, month_name, key, member, _ in filas])
+                else:
+                    conn.executemany('''
+                        insert into buckets (database, aggregation, year, month, month_name, key, value)
+                        values (?, ?, ?, ?, ?, ?, ?)
+                        on conflict (database, aggregation, year, month, key) do update set value = value + excluded.value
+                    ''', [(database, aggregation_name, year, month, month_name, key, value)
+                          for year, month, month_name, key, value, _ in filas])
+                nuevo = str(max(int(fila[5]) for fila in filas))
+                conn.execute('''
+                    insert into watermarks (database, aggregation, watermark) values (?, ?, ?)
+                    on conflict (database, aggregation) do update set watermark = excluded.watermark
+                ''', (database, aggregation_name, nuevo))
+            return len(filas)
+
+    # columns and rows of a report from the stored aggregates
+    def result(self, database, report_name):
+        with self._connect() as conn:
+            cursor = conn.execute(REPORTS[report_name].result_sql, (database,))
+            columnas = [desc[0] for desc in cursor.description]
+            return columnas, [tuple(fila) for fila in cursor.fetchall()]
+
+    # forget the aggregates of a database so the next refresh reads everything again
+    def reset(self, database, aggregation_name=None):
+        with self._connect() as conn:
+            for table in ('watermarks', 'buckets', 'members'):
+                if aggregation_name:
+                    conn.execute(f'delete from {table} where database = ? and aggregation = ?', (database, aggregation_name))
+                else:
+                    conn.execute(f'delete from {table} where database = ?', (database,))
@@ -0,0 +1,56 @@
+import importlib
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+# module imported the first time one of its attributes is used; before_import runs just before,
+# for setup that has to happen first (like the matplotlib backend)
+class LazyModule:
+    def __init__(self, name, before_import=None):
+        self._name = name
+        self._before_import = before_import
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    if self._before_import is not None:
+                        self._before_import()
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}' {'loaded' if self._module is not None else 'not loaded'}>"
+
+
+# load the modules and run the extra steps in a background thread; returns the thread,
+# the seconds it took are in thread.seconds when it finishes
+def warm_up(modules, steps=(), name='warmup'):
+    def run():
+        start_time = time.perf_counter()
+        #a module that fails here fails again, with its error, in the request that needs it
+        for module in modules:
+            try:
+                module.load()
+            except Exception as ex:
+                log.warning('No se pudo precargar %r: %s', module, ex)
+        for step in steps:
+            try:
+                step()
+            except Exception as ex:
+                log.warning('Error en la precarga: %s', ex)
+        thread.seconds = time.perf_counter() - start_time
+        log.info('Precarga terminada en %.3f segundos', thread.seconds)
+
+    thread = threading.Thread(target=run, name=name, daemon=True)
+    thread.seconds = None
+    thread.start()
+    return thread
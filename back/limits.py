@@ -0,0 +1,107 @@
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# seconds a query may run and the share of the database it takes, by the cost hint of the query;
+# QUERY_TIMEOUT_<COST> and QUERY_WEIGHT_<COST> in .env change them
+COST_LIMITS = {
+    'low': {'timeout': 30, 'weight': 1},
+    'medium': {'timeout': 60, 'weight': 2},
+    'high': {'timeout': 120, 'weight': 4},
+}
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+class ServerBusy(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+# timeout and weight of a query: its own timeout if it has one, otherwise the ones of its cost
+def limits_for(spec):
+    cost = spec.cost if spec.cost in COST_LIMITS else 'medium'
+    defaults = COST_LIMITS[cost]
+    timeout = int(os.getenv(f'QUERY_TIMEOUT_{cost.upper()}', defaults['timeout']))
+    weight = int(os.getenv(f'QUERY_WEIGHT_{cost.upper()}', defaults['weight']))
+    return (spec.timeout or timeout), weight
+
+
+# capacity of one database: the weight of the queries running and the queue of the ones waiting
+class _Gate:
+    def __init__(self):
+        self.used = 0
+        self.queue = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.waits = 0
+        self.max_wait_time = 0.0
+
+
+# limits the queries that run at the same time on each database; a query waits in a fifo queue
+# until its weight fits, and is rejected when the queue is full or the wait is too long
+class AdmissionControl:
+    def __init__(self, capacity=8, queue_limit=16, queue_timeout=30):
+        self.capacity = capacity
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self._gates = {}
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, database, weight=1):
+        weight = min(max(weight, 1), self.capacity)
+        self._enter(database, weight)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._gates[database].used -= weight
+                self._cond.notify_all()
+
+    def _enter(self, database, weight):
+        start = time.time()
+        with self._cond:
+            gate = self._gates.setdefault(database, _Gate())
+            if not gate.queue and gate.used + weight <= self.capacity:
+                gate.used += weight
+                gate.admitted += 1
+                return
+            if len(gate.queue) >= self.queue_limit:
+                gate.rejected += 1
+                raise ServerBusy('La base de datos está ocupada, intente de nuevo en unos segundos', retry_after=5)
+            ticket = object()
+            gate.queue.append(ticket)
+            gate.waits += 1
+            try:
+                #only the first of the queue can enter, so a heavy query is not passed by the light ones
+                while gate.queue[0] is not ticket or gate.used + weight > self.capacity:
+                    remaining = self.queue_timeout - (time.time() - start)
+                    if remaining <= 0:
+                        gate.rejected += 1
+                        raise ServerBusy('La base de datos sigue ocupada, intente de nuevo más tarde', retry_after=self.queue_timeout)
+                    self._cond.wait(remaining)
+            finally:
+                gate.queue.remove(ticket)
+                self._cond.notify_all()
+            gate.used += weight
+            gate.admitted += 1
+            gate.max_wait_time = max(gate.max_wait_time, time.time() - start)
+
+    def stats(self):
+        with self._cond:
+            return [{
+                'database': database,
+                'capacity': self.capacity,
+                'used': gate.used,
+                'waiting': len(gate.queue),
+                'admitted': gate.admitted,
+                'rejected': gate.rejected,
+                'waits': gate.waits,
+                'max_wait_time': gate.max_wait_time,
+            } for database, gate in self._gates.items()]
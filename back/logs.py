@@ -0,0 +1,126 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener
+
+# id of the current request, added to every record written while it runs
+request_id = ContextVar('request_id', default='-')
+
+
+def new_request_id(incoming=None):
+    value = (incoming or '')[:64] or uuid.uuid4().hex[:16]
+    request_id.set(value)
+    return value
+
+
+class RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+# one json object per line: time, level, logger, request id, message and the extra fields
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        record.request_id = getattr(record, 'request_id', '-')
+        text = super().format(record)
+        fields = getattr(record, 'fields', None)
+        if fields:
+            text += ' ' + ' '.join(f'{name}={value}' for name, value in fields.items())
+        return text
+
+
+# handlers of the current setup and the thread that writes them
+_state = {}
+
+
+def _start_listener(handlers):
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+    logging.getLogger().handlers = [queue_handler]
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    _state['listener'] = listener
+    return listener
+
+
+# a forked process (a gunicorn worker, a graph worker) does not have the thread of its parent,
+# it starts its own with the same handlers
+def _after_fork():
+    if 'handlers' in _state:
+        _start_listener(_state['handlers'])
+
+
+# the request threads only put the records in a queue, a background thread writes them;
+# files maps a logger name to an extra file that receives only the records of that logger
+def setup_logging(level='INFO', log_file=None, json_format=True, files=None):
+    formatter = JsonFormatter() if json_format else TextFormatter()
+    handlers = []
+    main_handler = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    main_handler.setFormatter(formatter)
+    handlers.append(main_handler)
+    for logger_name, path in (files or {}).items():
+        handler = logging.FileHandler(path, encoding='utf-8')
+        handler.setFormatter(formatter)
+        handler.addFilter(logging.Filter(logger_name))
+        handlers.append(handler)
+
+    logging.getLogger().setLevel(level)
+    if 'handlers' not in _state:
+        #windows has no fork, its development server is a single process
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=_after_fork)
+        atexit.register(lambda: _state['listener'].stop())
+    _state['handlers'] = handlers
+    return _start_listener(handlers)
+
+
+# allows a few samples of real data per minute, so the debug log shows the data without
+# writing every result
+class DataSampler:
+    def __init__(self, per_minute=6, rows=5):
+        self.per_minute = per_minute
+        self.rows = rows
+        self._tokens = float(per_minute)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.per_minute, self._tokens + (now - self._last) * self.per_minute / 60)
+            self._last = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    # first rows of a dataframe as lists, or None when there is no sample left this minute
+    def sample(self, df):
+        if not self.per_minute or not self.allow():
+            return None
+        head = df.head(self.rows)
+        return head.astype(object).where(head.notna(), None).values.tolist()
@@ -1,40 +1,388 @@
-import os
 import time
-import pyodbc as sql
-import pandas as pd
-import seaborn as sns
-import matplotlib
-import matplotlib.pyplot as plt
-from flask import Flask, render_template, request, redirect, url_for, session
+# moment the app started loading, to report how long the startup takes
+STARTUP_BEGIN = time.perf_counter()
+import contextvars
+import functools
+import hashlib
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+from contextlib import ExitStack, contextmanager
+from datetime import datetime
+from flask import Flask, Response, render_template, request, redirect, url_for, session, abort, stream_with_context, g, make_response, send_from_directory
 from dotenv import load_dotenv
-import statistics
-
-matplotlib.use('Agg')
+from cache import ResultCache
+from approx import PROBE_SQL as APPROX_PROBE_SQL, SERVER_ERROR as APPROX_SERVER_ERROR, count_with_sketch, server_sql, sketch_error, sketch_plan
+from chart_data import reduce_chart
+from charts import CHART_PRESETS, ChartRenderer, choose_format
+from export import ARROW_AVAILABLE, EXPORT_FORMATS, available_formats, batches_of, export_chunks
+from facts import FactStore
+from filters import InvalidFilter, parse_filters
+from graph_files import GraphSweeper, chart_digest, graph_is_fresh
+from incremental import REPORTS as INCREMENTAL_REPORTS, IncrementalStore
+from lazy import LazyModule, warm_up
+from limits import AdmissionControl, QueryTimeout, ServerBusy, limits_for
+from logs import DataSampler, new_request_id, request_id, setup_logging
+from measures import build_dataframe, columnar_payload, measures_of_tendency
+from metrics import Histogram, StageTimer, current_trace, render_values, server_timing, stage_breakdown, start_trace
+from pool import PoolManager, PoolTimeout
+from queries import get_query, list_queries, list_specs, load_queries_file
+from responses import choose_encoding, compress_stream, json_response
+from shared_store import ArrowRows, SharedResultStore
+from slow_queries import SlowQueryLog
+from snapshots import SnapshotScheduler, SnapshotStore
+
+# pyodbc loads the odbc driver manager, it is imported by the first connection
+sql = LazyModule('pyodbc')
 
 # load environment variables from .env file
 
 load_dotenv()
+
+# the log records go through a queue to a background thread, so a slow disk or terminal does not slow the requests;
+# LOG_FORMAT=text for the old one line format, SLOW_REQUEST_LOG gets its own file
+setup_logging(os.getenv('LOG_LEVEL', 'INFO'), os.getenv('LOG_FILE'), os.getenv('LOG_FORMAT', 'json') == 'json',
+              files={'app.slow_requests': os.getenv('SLOW_REQUEST_LOG')} if os.getenv('SLOW_REQUEST_LOG') else None)
+log = logging.getLogger('app')
+#matplotlib writes an info line for every graph with text labels
+logging.getLogger('matplotlib').setLevel(logging.WARNING)
+# the debug log shows a few rows of the results, at most LOG_SAMPLE_PER_MINUTE times a minute
+data_sampler = DataSampler(per_minute=int(os.getenv('LOG_SAMPLE_PER_MINUTE', 6)), rows=int(os.getenv('LOG_SAMPLE_ROWS', 5)))
+
 # configuration of Flask
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
 app.secret_key = os.getenv('SECRET_KEY')  # Cargar la clave secreta desde la variable de entorno
 
-# configuration of the database connection
-def get_db_connection():
-    if 'db_conn_details' in session:
+# extra queries registered from a json file, without touching the code
+if os.getenv('QUERIES_FILE'):
+    load_queries_file(os.getenv('QUERIES_FILE'))
+
+# cache of query results shared by every session that points to the same database
+result_cache = ResultCache(max_entries=int(os.getenv('CACHE_MAX_ENTRIES', 64)), ttl=int(os.getenv('CACHE_TTL_SECONDS', 300)))
+
+# with SHARED_RESULTS=1 (and pyarrow) the results are also written once to files that every process of
+# the server maps in memory, the cache of each process only keeps a view of them
+shared_store = None
+if os.getenv('SHARED_RESULTS') == '1':
+    if ARROW_AVAILABLE:
+        shared_store = SharedResultStore(os.getenv('SHARED_RESULTS_DIR', 'shared_results'), ttl=result_cache.ttl,
+                                         max_bytes=int(os.getenv('SHARED_RESULTS_MAX_MB', 512)) * 1024 * 1024)
+    else:
+        log.warning('SHARED_RESULTS necesita pyarrow, los resultados no se comparten entre procesos')
+
+# time of each stage of the pipeline by query and of each request by route, exposed in /metrics
+stage_timer = StageTimer(Histogram('app_stage_seconds', 'Time of each stage of the query pipeline', ['stage', 'query']))
+request_seconds = Histogram('app_request_seconds', 'Time of each request', ['endpoint'])
+
+# requests slower than SLOW_REQUEST_SECONDS are logged with their stages (to SLOW_REQUEST_LOG too, when set)
+SLOW_REQUEST_SECONDS = float(os.getenv('SLOW_REQUEST_SECONDS', 0))
+slow_request_log = logging.getLogger('app.slow_requests')
+
+# executions of the database slower than SLOW_QUERY_SECONDS are kept with their plan and io in a
+# rotating json log (SLOW_QUERY_LOG), /slow_queries lists the worst of each query
+SLOW_QUERY_SECONDS = float(os.getenv('SLOW_QUERY_SECONDS', 0))
+slow_query_log = SlowQueryLog(os.getenv('SLOW_QUERY_LOG', 'slow_queries.log'), SLOW_QUERY_SECONDS,
+                              max_bytes=int(os.getenv('SLOW_QUERY_LOG_MAX_MB', 10)) * 1024 * 1024,
+                              backups=int(os.getenv('SLOW_QUERY_LOG_BACKUPS', 5)),
+                              capture_plans=os.getenv('SLOW_QUERY_PLANS', '1') == '1',
+                              capture_io=os.getenv('SLOW_QUERY_IO', '1') == '1') if SLOW_QUERY_SECONDS else None
+
+# graphs are rendered in a pool of processes and named by the hash of their data, old files are removed by the sweeper
+chart_renderer = ChartRenderer(workers=int(os.getenv('CHART_WORKERS', 2)), queue_limit=int(os.getenv('CHART_QUEUE_LIMIT', 32)), timeout=int(os.getenv('CHART_TIMEOUT_SECONDS', 60)),
+                               on_rendered=lambda kind, query_id, seconds: stage_timer.observe(f'chart_{kind}', query_id, seconds))
+# format of the graphs (auto, svg, webp or png) and their size preset (carousel, compact or print)
+CHART_FORMAT = os.getenv('CHART_FORMAT', 'auto')
+# formats a graph file can have: the one of CHART_FORMAT or the ones auto chooses from
+GRAPH_FORMATS = ('svg', 'webp') if CHART_FORMAT == 'auto' else (CHART_FORMAT,)
+CHART_PRESET = os.getenv('CHART_PRESET', 'carousel')
+# bars and slices drawn before the rest goes to Otros, series of a grouped bar chart and bins of the histogram
+CHART_LIMITS = {
+    'bar_top_n': int(os.getenv('CHART_TOP_N', 15)),
+    'pie_top_n': int(os.getenv('CHART_PIE_TOP_N', 8)),
+    'max_series': int(os.getenv('CHART_MAX_SERIES', 6)),
+    'hist_bins': int(os.getenv('CHART_HIST_BINS', 10)),
+}
+# the name of a graph file changes with its content, so the browser can keep it for a year
+GRAPH_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+GRAPH_MIMETYPES = {'.png': 'image/png', '.webp': 'image/webp', '.svg': 'image/svg+xml'}
+graph_sweeper = GraphSweeper(os.path.join(app.static_folder, 'graphs'), max_age=int(os.getenv('GRAPHS_MAX_AGE_SECONDS', 24 * 3600)), max_bytes=int(os.getenv('GRAPHS_MAX_MB', 200)) * 1024 * 1024)
+
+# rows read from the cursor in each round trip, and rows shown in each page of the table
+FETCH_BATCH_SIZE = int(os.getenv('FETCH_BATCH_SIZE', 1000))
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', 50))
+MAX_PAGE_SIZE = 500
+
+# the reports are stored periodically from this connection and served from the local store
+SNAPSHOT_CONNECTION = os.getenv('SNAPSHOT_CONNECTION')
+SNAPSHOT_INTERVAL_SECONDS = int(os.getenv('SNAPSHOT_INTERVAL_SECONDS', 3600))
+snapshot_store = SnapshotStore(os.getenv('SNAPSHOT_DB', 'snapshots.db')) if SNAPSHOT_CONNECTION else None
+
+# the year/month reports keep partial aggregates in a local store and only read the new rows
+incremental_store = IncrementalStore(os.getenv('INCREMENTAL_DB', 'incremental.db')) if os.getenv('INCREMENTAL_AGGREGATION') == '1' else None
+
+# the passenger reports are computed in memory from one shared read of the occupations
+fact_store = FactStore(ttl=int(os.getenv('FACTS_TTL_SECONDS', 3600))) if os.getenv('FACT_EXTRACTION') == '1' else None
+
+# the reports with count(distinct ...) can be asked with an approximate count: APPROX_MODE=auto uses
+# approx_count_distinct when the server has it and a local sketch when not, server or sketch force one;
+# APPROX_PRECISION sets the size (and error) of the sketch
+APPROX_MODE = os.getenv('APPROX_MODE', 'auto')
+APPROX_PRECISION = int(os.getenv('APPROX_PRECISION', 14))
+approx_on_server = {}
+
+# reports of the dashboard that run at the same time, time limit and rows shown of each one
+DASHBOARD_PARALLEL = int(os.getenv('DASHBOARD_PARALLEL', 4))
+DASHBOARD_TIMEOUT_SECONDS = int(os.getenv('DASHBOARD_TIMEOUT_SECONDS', 120))
+DASHBOARD_PREVIEW_ROWS = int(os.getenv('DASHBOARD_PREVIEW_ROWS', 10))
+
+# queries running at the same time on each database, by the weight of their cost, and the queue of the waiting ones
+admission = AdmissionControl(
+    capacity=int(os.getenv('DB_MAX_WEIGHT', 8)),
+    queue_limit=int(os.getenv('DB_QUEUE_LIMIT', 16)),
+    queue_timeout=int(os.getenv('DB_QUEUE_TIMEOUT_SECONDS', 30)),
+)
+
+# a new connection of a pool, with the session settings every statement on it needs
+def connect_database(conn_details):
+    conn = sql.connect(conn_details, autocommit=True)
+    if slow_query_log is not None:
+        slow_query_log.prepare(conn)
+    return conn
+
+# configuration of the database connection, one pool of connections for each connection string
+connection_pools = PoolManager(
+    connect_database,
+    min_size=int(os.getenv('POOL_MIN_SIZE', 1)),
+    max_size=int(os.getenv('POOL_MAX_SIZE', 5)),
+    idle_timeout=int(os.getenv('POOL_IDLE_TIMEOUT_SECONDS', 300)),
+    checkout_timeout=int(os.getenv('POOL_CHECKOUT_TIMEOUT_SECONDS', 30)),
+)
+
+# server and database of a connection string, used as cache key (never the credentials)
+def db_target(conn_details):
+    params = {}
+    for part in conn_details.split(';'):
+        if '=' in part:
+            name, value = part.split('=', 1)
+            params[name.strip().upper()] = value.strip()
+    return f"{params.get('SERVER', '').lower()}/{params.get('DATABASE', '').lower()}"
+
+def get_db_target():
+    conn_details = session.get('db_conn_details')
+    if not conn_details:
+        return None
+    return db_target(conn_details)
+
+# ODBC states of a statement stopped by its timeout or cancelled
+CANCEL_SQLSTATES = ('HYT00', 'HY008')
+
+@contextmanager
+def cancel_as_timeout(timeout):
+    try:
+        yield
+    except sql.Error as ex:
+        if ex.args and ex.args[0] in CANCEL_SQLSTATES:
+            raise QueryTimeout(f'La consulta tardó más de {timeout} segundos y fue cancelada') from ex
+        raise
+
+# write an execution to the slow query log; a connection its plan left unusable is not reused
+def record_slow_query(pool, conn, cursor, *args, **kwargs):
+    entry = slow_query_log.record(conn, cursor, *args, **kwargs)
+    if entry.get('connection_broken'):
+        pool.discard(conn)
+
+# execute a query in a pooled connection, reading the rows in batches; with a timeout the driver
+# cancels the statement in the server, and a timer cancels it if reading the rows takes too long;
+# the slow ones and the cancelled ones go to the slow query log with the connection still open
+def execute_query(pool, consulta, params=(), query_id=None, timeout=None):
+    with ExitStack() as stack:
+        etapas = {}
+        connect_start = time.time()
+        with stage_timer.span('connect', query_id):
+            conn = stack.enter_context(pool.connection())
+        etapas['connect'] = time.time() - connect_start
+        conn.timeout = timeout or 0
+        stack.callback(setattr, conn, 'timeout', 0)
+        cursor = conn.cursor()
+        if timeout:
+            watchdog = threading.Timer(timeout, cursor.cancel)
+            watchdog.start()
+            stack.callback(watchdog.cancel)
+        stack.enter_context(cancel_as_timeout(timeout))
+        start_time = time.time()
+        resultados = []
         try:
-            conn_details = session['db_conn_details']
-            conn = sql.connect(conn_details)
-            return conn
+            with stage_timer.span('execute', query_id):
+                cursor.execute(consulta, *params)
+            etapas['execute'] = time.time() - start_time
+            columnas = [desc[0] for desc in cursor.description]
+            with stage_timer.span('fetch', query_id):
+                while True:
+                    filas = cursor.fetchmany(FETCH_BATCH_SIZE)
+                    if not filas:
+                        break
+                    resultados.extend(tuple(fila) for fila in filas)
         except sql.Error as ex:
-            print(f"Error al conectar con la base de datos: {ex}")
-            return None
-    return None
-
-def close_db_connection(conn):
-    if conn:
-        conn.close()
-        print("Conexión cerrada")
-    session.pop('db_conn_details', None)
+            if slow_query_log is not None and ex.args and ex.args[0] in CANCEL_SQLSTATES:
+                record_slow_query(pool, conn, cursor, consulta, params, time.time() - start_time, etapas, query_id, len(resultados),
+                                  error=f'Cancelada después de {timeout} segundos')
+            raise
+        db_time = time.time() - start_time
+        etapas['fetch'] = db_time - etapas['execute']
+        if slow_query_log is not None and slow_query_log.is_slow(db_time):
+            record_slow_query(pool, conn, cursor, consulta, params, db_time, etapas, query_id, len(resultados))
+        cursor.close()
+    return columnas, resultados, db_time
+
+# run a registered query in the database; the reports with incremental aggregates only read
+# the rows after their watermark and are computed from the local store, the passenger reports
+# are computed from the facts of the database read once for all of them; every path waits for its
+# turn on the database and runs with the time limit of the query
+def compute_query(pool, database, spec):
+    timeout, weight = limits_for(spec)
+    with admission.slot(database, weight):
+        if (incremental_store is None or not spec.incremental) and fact_store is not None and spec.facts:
+            start_time = time.time()
+            with stage_timer.span('facts', spec.id), cancel_as_timeout(timeout):
+                columnas, resultados = fact_store.compute(database, spec.facts, pool.connection, timeout)
+            return columnas, resultados, time.time() - start_time
+        if incremental_store is None or not spec.incremental:
+            return execute_query(pool, spec.sql, spec.params, query_id=spec.id, timeout=timeout)
+        start_time = time.time()
+        aggregation = INCREMENTAL_REPORTS[spec.incremental].aggregation
+        incremental_store.refresh(database, aggregation, lambda consulta, params: execute_query(pool, consulta, params, spec.id, timeout)[1])
+        columnas, resultados = incremental_store.result(database, spec.incremental)
+        return columnas, resultados, time.time() - start_time
+
+# whether the database has approx_count_distinct, asked once for each database
+def server_has_approx(pool, database):
+    if APPROX_MODE != 'auto':
+        return APPROX_MODE == 'server'
+    if database not in approx_on_server:
+        try:
+            #its stages go to the metrics under their own label, not with the ids of the queries
+            execute_query(pool, APPROX_PROBE_SQL, query_id='approx_probe')
+            approx_on_server[database] = True
+        except sql.Error:
+            approx_on_server[database] = False
+    return approx_on_server[database]
+
+# run a report with an approximate distinct count, in the server or streaming its keys to a local
+# sketch; returns also how it was computed and its relative error
+def compute_approximate(pool, database, spec):
+    timeout, weight = limits_for(spec)
+    with admission.slot(database, weight):
+        start_time = time.time()
+        if server_has_approx(pool, database):
+            columnas, resultados, db_time = execute_query(pool, server_sql(spec.sql), spec.params, query_id=spec.id, timeout=timeout)
+            return columnas, resultados, db_time, {'method': 'server', 'error': APPROX_SERVER_ERROR, 'confidence': 0.97}
+        with ExitStack() as stack:
+            with stage_timer.span('connect', spec.id):
+                conn = stack.enter_context(pool.connection())
+            conn.timeout = timeout
+            stack.callback(setattr, conn, 'timeout', 0)
+            stack.enter_context(cancel_as_timeout(timeout))
+            with stage_timer.span('sketch', spec.id):
+                columnas, resultados = count_with_sketch(conn.cursor(), sketch_plan(spec.sql, spec.metric_column), precision=APPROX_PRECISION, params=spec.params)
+        return columnas, resultados, time.time() - start_time, {'method': 'sketch', 'error': sketch_error(APPROX_PRECISION), 'confidence': 0.95}
+
+# the reports answered from the incremental or the facts stores, exact and without going to the database
+def computed_locally(spec):
+    return bool((incremental_store is not None and spec.incremental) or (fact_store is not None and spec.facts))
+
+# execute a registered query for an export: yields the description of the cursor and then the rows
+# in batches as they are read, holding the connection and the turn on the database until the end;
+# only the execute has the time limit, reading the rows goes at the pace of the download
+def stream_query(pool, database, spec):
+    timeout, weight = limits_for(spec)
+    with admission.slot(database, weight), pool.connection() as conn:
+        conn.timeout = timeout
+        try:
+            cursor = conn.cursor()
+            with cancel_as_timeout(timeout):
+                cursor.execute(spec.sql, *spec.params)
+        finally:
+            conn.timeout = 0
+        try:
+            yield cursor.description
+            while True:
+                filas = cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not filas:
+                    break
+                yield filas
+        finally:
+            cursor.close()
+
+# result already computed, by this process ('cache') or by another one ('shared'), or None
+def cached_result(key):
+    entry = result_cache.get(key)
+    if entry is not None:
+        return entry, 'cache'
+    if shared_store is not None:
+        shared = shared_store.get(key)
+        if shared is not None:
+            return result_cache.set(key, shared.columns, shared.rows, shared.db_time, snapshot_at=shared.snapshot_at,
+                                    approximate=shared.approximate, created_at=shared.created_at), 'shared'
+    return None, None
+
+# keep a new result in the cache; with the shared store it is written there once and the cache
+# keeps the rows mapped from its file instead of its own copy
+def store_result(key, columnas, resultados, db_time, snapshot_at=None, approximate=None):
+    if shared_store is not None:
+        mapped = shared_store.put(key, columnas, resultados, db_time, snapshot_at=snapshot_at, approximate=approximate)
+        if mapped is not None:
+            resultados = mapped
+    return result_cache.set(key, columnas, resultados, db_time, snapshot_at=snapshot_at, approximate=approximate)
+
+# forget the results of a database (or of one query) in this process and in the shared store
+def invalidate_results(database, query_id=None):
+    removed = result_cache.invalidate(database, query_id)
+    if shared_store is not None:
+        removed += shared_store.invalidate(database, query_id)
+    return removed
+
+# key of a result in the caches: the approximate and the filtered results of a report have their own
+def result_key(database, spec, approximate=False):
+    return (database, spec.id) + (('approx',) if approximate else ()) + spec.filter_key
+
+# the stored snapshot of a report, only of the full report of the database of the snapshots
+def has_snapshot(database, spec):
+    return snapshot_store is not None and not spec.filter_values and database == db_target(SNAPSHOT_CONNECTION)
+
+# take the result from the cache, the shared store, the stored snapshot or the database, in that order;
+# returns the entry and where it came from ('cache', 'shared', 'snapshot' or 'database'); an approximate
+# result has its own entry in the cache and never comes from a snapshot
+def fetch_query_results(spec, conn_details, refresh=False, approximate=False):
+    approximate = approximate and spec.approximable and not computed_locally(spec)
+    key = result_key(db_target(conn_details), spec, approximate)
+    if refresh:
+        invalidate_results(key[0], spec.id)
+        if fact_store is not None and spec.facts:
+            fact_store.invalidate(key[0])
+    entry, origen = cached_result(key)
+    if entry is not None:
+        return entry, origen
+
+    if approximate:
+        columnas, resultados, db_time, aproximacion = compute_approximate(connection_pools.get(conn_details), key[0], spec)
+        return store_result(key, columnas, resultados, db_time, approximate=aproximacion), 'database'
+
+    if not refresh and has_snapshot(key[0], spec):
+        snapshot = snapshot_store.load(*key)
+        if snapshot is not None:
+            entry = store_result(key, snapshot['columns'], snapshot['rows'], snapshot['db_time'], snapshot_at=snapshot['taken_at'])
+            return entry, 'snapshot'
+
+    columnas, resultados, db_time = compute_query(connection_pools.get(conn_details), key[0], spec)
+    return store_result(key, columnas, resultados, db_time), 'database'
+
+# end the connection of the session; the pool is shared with the other sessions of the same
+# connection string, its connections are closed when nobody uses it for POOL_IDLE_TIMEOUT_SECONDS
+def close_db_connection():
+    conn_details = session.pop('db_conn_details', None)
+    if conn_details:
+        log.info('Conexión cerrada')
 
 # Route of the inicial page
 @app.route('/')
@@ -44,25 +392,7 @@ def login_page():
 # route of index
 @app.route('/index')
 def index_page():
-    queries = [
-        [1, "Número de personas que viajaron por cada estado"],
-        [2, "Número de personas que viajaron por cada estado, por cada año"],
-        [3, "Número de personas que viajaron de cada combinación municipios, estado"], 
-        [4, "Número de vuelos por cada año"],
-        [5, "Número de vuelos por cada mes año"], 
-        [6, "Número de personas que viajaron de acuerdo a su categoría: Niños hasta 12 años, adolescentes de 13 a 17 años, jóvenes de 18 a 30 años, adultos de 30 a 59 años y adultos mayores de 60 en adelante"], 
-        [7, "Número de vuelos por cada aeropuerto de salida en cada año, del aeropuerto se desea saber la clave internacional del aeropuerto y la clave internacional del país al que pertenece el aeropuerto"], 
-        [8, "Número de vuelos por aerolínea (detalle_vuelos)"],
-        [9, "Número de vuelos realizados por aerolínea, por cada año"], 
-        [10, "Número de personas que viajan por cada estado, muestre los 10 estados a los que más personas viajan"], 
-        [11, "Número de personas que viajan por cada año"], 
-        [12, "Nombre, ciudad y país de los 10 aeropuertos de los que más personas parten hacia algún destino"], 
-        [13, "Número de personas que viajan por cada mes"], 
-        [14, "Nombre de los 10 municipios de los que más personas viajan, agregue el nombre del estado"], 
-        [15, "Nombre de los 10 municipios de los que menos personas viajan, agregue el nombre del estado"],
-        [16, "Nombre del o los aeropuertos de los que menos personas parten, muestre la ciudad y el país al que pertenece"]
-    ]
-    return render_template('index.html', queries=queries)
+    return render_template('index.html', queries=list_queries())
 
 # Route to manage the login
 @app.route('/login', methods=['POST'])
@@ -78,11 +408,15 @@ def login():
             connection_string = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};Trusted_Connection=yes;"
         else:
             connection_string = f"DRIVER={{ODBC Driver 17 for SQL Server}};SERVER={server};DATABASE={database};UID={user};PWD={password};"
-        conn = sql.connect(connection_string)
+        #the connection used to validate the credentials stays in the pool for the first query
+        pool = connection_pools.get(connection_string)
+        with pool.connection():
+            pass
+        pool.prefill()
         session['db_conn_details'] = connection_string
-        conn.close()
         return redirect(url_for('index_page')) 
     except sql.Error as ex:
+        connection_pools.discard_empty(connection_string)
         sqlstate = ex.args[1]
         error_message = f"Error de conexión: {sqlstate}"
         return render_template('login.html', error=error_message)
@@ -90,766 +424,547 @@ def login():
 # route to destroy sesion
 @app.route('/logout', methods=['POST'])
 def logout():
-    conn = get_db_connection()
-    close_db_connection(conn)
+    close_db_connection()
     return redirect(url_for('login_page'))
 
 # config before the request
 @app.before_request
 def before_request():
-    print("Iniciando nueva solicitud")
+    #the id of the proxy is kept, so the lines of both can be joined
+    new_request_id(request.headers.get('X-Request-ID'))
+    log.debug('Iniciando nueva solicitud', extra={'fields': {'method': request.method, 'path': request.path}})
+    g.request_start = time.perf_counter()
+    start_trace()
+
+# time of the request by route, and the slow ones with their stages to the slow request log
+@app.after_request
+def after_request(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        elapsed = time.perf_counter() - start
+        request_seconds.observe(elapsed, request.endpoint or 'not_found')
+        if SLOW_REQUEST_SECONDS and elapsed >= SLOW_REQUEST_SECONDS:
+            etapas = {stage: round(seconds, 3) for stage, seconds in stage_breakdown(current_trace())}
+            slow_request_log.warning('%s %s %s %.3fs', request.method, request.path, response.status_code, elapsed,
+                                     extra={'fields': {'seconds': round(elapsed, 3), 'stages': etapas}})
+    response.headers['X-Request-ID'] = request_id.get()
+    return response
+
+# dataframe of a result; the one of a result of this process is built once and kept in its entry, the
+# one of a shared result is built for the request (only with the given columns) and dropped after it,
+# so the workers do not keep a copy each of what the store maps once
+def result_dataframe(spec, resultado, columns=None):
+    derivados = resultado.derived
+    if 'df' in derivados:
+        return derivados['df'] if columns is None else derivados['df'][list(columns)]
+    shared = isinstance(resultado.rows, ArrowRows)
+    with stage_timer.span('adapt', spec.id):
+        df = build_dataframe(resultado.rows, spec.columns, only=columns if shared else None)
+    if not shared:
+        derivados['df'] = df
+        if columns is not None:
+            df = df[list(columns)]
+    return df
+
+# execute the query (or take it from the cache) and compute the measures of tendency over the full
+# result, only once per result; the dataframe is asked with result_dataframe by who needs it
+def load_query_result(spec, conn_details, refresh=False, approximate=False):
+    resultado, origen = fetch_query_results(spec, conn_details, refresh, approximate)
+    derivados = resultado.derived
+    if 'medidas' not in derivados:
+        metrica = result_dataframe(spec, resultado, [spec.metric_column])[spec.metric_column]
+        with stage_timer.span('stats', spec.id):
+            derivados['medidas'] = measures_of_tendency(metrica)
+        #only the size of the result goes to the log, the rows only in a few debug samples
+        log.info('Resultado de la consulta %s', spec.id, extra={'fields': {'query': spec.id, 'rows': len(resultado.rows), 'columns': len(resultado.columns)}})
+        if log.isEnabledFor(logging.DEBUG):
+            muestra = data_sampler.sample(result_dataframe(spec, resultado))
+            if muestra is not None:
+                log.debug('Muestra de la consulta %s', spec.id, extra={'fields': {'query': spec.id, 'sample': muestra}})
+    return resultado, origen, derivados['medidas']
+
+# shared pipeline of the registered queries for the result page: result, graphs and the rows of one page
+def run_query(spec, client_charts=False):
+    approximate = use_approximate()
+    resultado, origen, medidas = load_query_result(spec, session['db_conn_details'], bool(request.form.get('refresh')), approximate)
+    resultados = resultado.rows
+
+    #with client charts the browser draws them from the api, nothing is rendered in the server
+    graphs = {'graphs_ready': {}}
+    if not client_charts:
+        graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{spec.id}')
+        #the dataframe is only built when the digest of the result is not known yet or a graph must be drawn
+        load_df = functools.cache(lambda: result_dataframe(spec, resultado))
+        with stage_timer.span('graphs', spec.id):
+            if 'graph_digest' not in resultado.derived:
+                resultado.derived['graph_digest'] = graph_digest(load_df(), spec.chart)
+            bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(load_df, graph_path_base, resultado.derived['graph_digest'], query_id=spec.id, **spec.chart)
+        graphs = {
+            'bar_plot': static_filename(bar_plot),
+            'hist_plot': static_filename(hist_plot),
+            'pie_plot': static_filename(pie_plot),
+            #the graphs already on disk go straight in the page, without asking for their status
+            'graphs_ready': {kind: chart_renderer.status(path)[0] == 'ready' for kind, path in (('bar', bar_plot), ('hist', hist_plot), ('pie', pie_plot))},
+        }
+
+    #only the rows of the requested page go to the template
+    page_size = min(max(request.form.get('page_size', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    pages = max((len(resultados) + page_size - 1) // page_size, 1)
+    page = min(max(request.form.get('page', 1, type=int), 1), pages)
+    inicio = (page - 1) * page_size
+
+    return {
+        'columnas': resultado.columns,
+        'resultados': resultados[inicio:inicio + page_size],
+        'count': len(resultados),
+        'page': page,
+        'pages': pages,
+        'page_size': page_size,
+        'first_row': inicio + 1 if resultados else 0,
+        'last_row': min(inicio + page_size, len(resultados)),
+        'medidas': medidas,
+        'client_charts': client_charts,
+        'chart': spec.chart,
+        'graph_size': graph_size(),
+        'export_formats': available_formats(),
+        'approximate': resultado.approximate,
+        'approx_available': spec.approximable and not computed_locally(spec),
+        'approx_requested': approximate,
+        'filtros_disponibles': list(spec.filters),
+        #the filters as text, for the links and forms of the page
+        'filtros': {param: str(value) for param, value in spec.filter_values.items()},
+        **graphs,
+        'origen': origen,
+        'snapshot_at': resultado.snapshot_at,
+        'db_time': resultado.db_time,
+        'cache_age': time.time() - resultado.created_at,
+    }
 
 #route to show query
 @app.route('/query/<int:id>/<string:name>/', methods=['POST'])
 def visualizar_consulta(id, name):
-    consulta_seleccionada = id
-    query = name
-    db_conn = get_db_connection()
-    #print("Conexión obtenida de la sesión:", db_conn)
-    if db_conn:
+    spec = get_query(id)
+    if spec is None:
+        abort(404)
+    if 'db_conn_details' in session:
         try:
-            cursor = db_conn.cursor()
             start_time = time.time()
-    
-            if consulta_seleccionada == 1:
-                consulta ='''
-                select e.nombre as Estados, count(o.cve_clientes) as Número_de_personas_que_viajaron
-                from Ocupaciones as o
-                join clientes as c on o.cve_clientes = c.cve_clientes
-                join estados as e on c.cve_estados = e.cve_estados
-                group by e.nombre
-                order by Número_de_personas_que_viajaron desc
-                '''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[1] for fila in resultados if isinstance(fila[1], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                                #create the data to create the graphs
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Estados','Número_de_personas_que_viajaron']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Estados', bar_y_col='Número_de_personas_que_viajaron', hist_col='Número_de_personas_que_viajaron', pie_index_col='Estados', pie_values_col='Número_de_personas_que_viajaron',orientation='vertical')
-            elif consulta_seleccionada == 2:
-                consulta = '''
-                select e.nombre as Estado, year(dv.fecha_hora_salida) as año,count(distinct o.cve_clientes) as Número_personas_que_viajaron
-                from ocupaciones as o
-                join clientes as c on o.cve_clientes = c.cve_clientes
-                join estados as e on c.cve_estados = e.cve_estados
-                join detalle_vuelos as dv ON o.cve_detalle_vuelos = dv.cve_detalle_vuelos
-                group by e.nombre, YEAR(dv.fecha_hora_salida)
-                '''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[2] for fila in resultados if isinstance(fila[2], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                                #create the data to create the graphs
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Estado','año','Número_de_personas_que_viajaron']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Estado', bar_y_col='Número_de_personas_que_viajaron', hist_col='Número_de_personas_que_viajaron', pie_index_col='Estado', pie_values_col='Número_de_personas_que_viajaron',orientation='vertical')
-            elif consulta_seleccionada == 3:
-                consulta ='''
-                select e.nombre as Estado, m.nombre as Municipio, count(c.cve_clientes) as Número_de_persona
-                from clientes as c
-                join ocupaciones as o on o.cve_clientes = c.cve_clientes
-                join estados as e on e.cve_estados = c.cve_estados
-                join municipios as m on e.cve_estados = m.cve_estados and m.cve_estados = c.cve_estados
-                group by e.nombre, m.nombre
-                order by e.nombre
-                '''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[2] for fila in resultados if isinstance(fila[2], (int, float))]
-                        
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create the data to create the graphs
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Estado','Municipio','Número_de_persona']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Estado', bar_y_col='Número_de_persona', hist_col='Número_de_persona', pie_index_col='Estado', pie_values_col='Número_de_persona',orientation='vertical')
-            elif consulta_seleccionada == 4:
-                consulta = '''
-                select  year(dv.fecha_hora_salida) as Año,count(dv.cve_vuelos) as Número_de_vuelos
-                from detalle_vuelos as dv
-                group by year(dv.fecha_hora_salida)
-                '''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[1] for fila in resultados if isinstance(fila[1], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create the data to create the graphs
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Año','Número_de_vuelos']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Año', bar_y_col='Número_de_vuelos', hist_col='Número_de_vuelos', pie_index_col='Año', pie_values_col='Número_de_vuelos',orientation='horizontal')
-            elif consulta_seleccionada == 5:
-                consulta= '''
-                select datename(month,dv.fecha_hora_salida) as Mes, year(dv.fecha_hora_salida) as Año, count(dv.cve_vuelos) as Número_de_vuelos
-                from detalle_vuelos as dv
-                group by datename(month,dv.fecha_hora_salida),year(dv.fecha_hora_salida)
-                '''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[2] for fila in resultados if isinstance(fila[2], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create the data to create the graphs
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Mes','Año','Número_de_vuelos']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Mes', bar_y_col='Número_de_vuelos', hist_col='Número_de_vuelos', pie_index_col='Mes', pie_values_col='Número_de_vuelos',orientation='vertical')
-            elif consulta_seleccionada == 6:
-                consulta = '''
-                select case
-                when datediff(year, c.fecha_nacimiento,getdate()) <= 12 then 'Niños hasta 12 años'
-                when datediff(year, c.fecha_nacimiento, getdate()) between 13 and 17 then 'Adolescentes de 13 a 17 años'
-                when datediff(year, c.fecha_nacimiento, getdate()) between 18 and 30 then 'Jóvenes de 18 a 30 años'
-                when datediff(year, c.fecha_nacimiento, getdate()) between 31 and 59 then 'Adultos de 31 a 59 años'
-                else 'Adultos mayores de 60 años' end as Categoría_de_edad, count(distinct c.cve_clientes) as número_de_personas
-                from clientes as c
-                join ocupaciones as o on c.cve_clientes = o.cve_clientes
-                group by case
-                when datediff(year, c.fecha_nacimiento,getdate()) <= 12 then 'Niños hasta 12 años'
-                when datediff(year, c.fecha_nacimiento, getdate()) between 13 and 17 then 'Adolescentes de 13 a 17 años'
-                when datediff(year, c.fecha_nacimiento, getdate()) between 18 and 30 then 'Jóvenes de 18 a 30 años'
-                when datediff(year, c.fecha_nacimiento, getdate()) between 31 and 59 then 'Adultos de 31 a 59 años'
-                else 'Adultos mayores de 60 años'
-                end
-                '''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[1] for fila in resultados if isinstance(fila[1], (int))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Categoría_de_edad','número_de_personas']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Categoría_de_edad', bar_y_col='número_de_personas', hist_col='número_de_personas', pie_index_col='Categoría_de_edad', pie_values_col='número_de_personas',orientation='vertical')
-            elif consulta_seleccionada == 7:
-                consulta = '''
-                select year(dv.fecha_hora_salida) as Año, a.clave_internacional as Clave_internacional, p.clave_internacional as Clave_internacional_del_pais,
-                count(dv.cve_vuelos) as Número_de_vuelos
-                from detalle_vuelos as dv
-                join vuelos as v on dv.cve_vuelos = v.cve_vuelos
-                join aeropuertos as a on v.cve_aeropuertos__origen = a.cve_aeropuertos
-                join ciudades as c on a.cve_ciudades = c.cve_ciudades
-                join paises as p on c.cve_paises = p.cve_paises
-                group by year(dv.fecha_hora_salida), a.clave_internacional, p.clave_internacional 
-                order by año,a.clave_internacional'''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[3] for fila in resultados if isinstance(fila[3], (int))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Año','Clave_internacional','Clave_internacional_del_pais','Número_de_vuelos']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Año', bar_y_col='Número_de_vuelos', hist_col='Número_de_vuelos', pie_index_col='Año', pie_values_col='Número_de_vuelos',orientation='horizontal')
-    
-
-            elif consulta_seleccionada == 8:
-                consulta = '''
-                select a.nombre as Aerolínea,count(dv.cve_detalle_vuelos) as Número_de_vuelos
-                from detalle_vuelos as dv
-                join vuelos as v on dv.cve_vuelos = v.cve_vuelos
-                join aerolineas as a on v.cve_aerolineas = a.cve_aerolineas
-                group by a.nombre
-                '''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[1] for fila in resultados if isinstance(fila[1], (int, float))]
-                 
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Aerolínea','Número_de_vuelos']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Aerolínea', bar_y_col='Número_de_vuelos', hist_col='Número_de_vuelos', pie_index_col='Aerolínea', pie_values_col='Número_de_vuelos',orientation='horizontal')
-            elif consulta_seleccionada == 9:
-                consulta = '''
-                select a.nombre as Aerolíneas, year(dv.fecha_hora_salida) as Año,count(dv.cve_detalle_vuelos) as Número_de_vuelos
-                from detalle_vuelos as dv
-                join vuelos as v on dv.cve_vuelos = v.cve_vuelos
-                join aerolineas as a on v.cve_aerolineas = a.cve_aerolineas
-                group by a.nombre, year(dv.fecha_hora_salida)'''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[2] for fila in resultados if isinstance(fila[2], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Aerolíneas','Año','Número_de_vuelos']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Aerolíneas', bar_y_col='Número_de_vuelos', hist_col='Número_de_vuelos', pie_index_col='Aerolíneas', pie_values_col='Número_de_vuelos',orientation='horizontal')
-            elif consulta_seleccionada == 10:
-                consulta = '''
-                select top 10 e.nombre as Estado ,count(distinct o.cve_clientes) as Número_de_personas
-                from clientes as c
-                join ocupaciones as o on o.cve_clientes = c.cve_clientes
-                join estados as e on e.cve_estados = c.cve_estados
-                group by e.nombre
-                order by Número_de_personas desc'''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[1] for fila in resultados if isinstance(fila[1], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Estado','Número_de_personas']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Estado', bar_y_col='Número_de_personas', hist_col='Número_de_personas', pie_index_col='Estado', pie_values_col='Número_de_personas',orientation='vertical')
-
-            elif consulta_seleccionada == 11:
-                consulta = '''
-                select count(o.cve_clientes) as Número_de_personas, year(dv.fecha_hora_salida) as Año
-                from clientes as c
-                join ocupaciones as o on o.cve_clientes = c.cve_clientes
-                join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
-                group by year(dv.fecha_hora_salida)'''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[1] for fila in resultados if isinstance(fila[1], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Número_de_personas','Año']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Año', bar_y_col='Número_de_personas', hist_col='Número_de_personas', pie_index_col='Año', pie_values_col='Número_de_personas',orientation='horizontal')
-
-            elif consulta_seleccionada == 12:
-                consulta = '''
-                select top 10 a.nombre as Aeropuerto, ci.nombre as Cuidad,p.nombre as País,count(distinct c.cve_clientes) as Número_de_personas
-                from clientes as c
-                join ocupaciones as o on o.cve_clientes = c.cve_clientes
-                join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
-                join vuelos as v on v.cve_vuelos = dv.cve_vuelos
-                join aeropuertos as a on a.cve_aeropuertos = v.cve_aeropuertos__origen
-                join ciudades as ci on ci.cve_ciudades = a.cve_ciudades
-                join paises as p on p.cve_paises = ci.cve_paises
-                group by a.nombre, ci.nombre, p.nombre
-                '''
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[3] for fila in resultados if isinstance(fila[3], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Aeropuerto','Cuidad','País','Número_de_personas']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Aeropuerto', bar_y_col='Número_de_personas', hist_col='Número_de_personas', pie_index_col='Aeropuerto', pie_values_col='Número_de_personas',orientation='horizontal')
-                
-            elif consulta_seleccionada == 13:
-                consulta = '''
-                select datename(month,dv.fecha_hora_salida) as Mes,count(distinct c.cve_clientes) as Número_de_personas
-                from clientes as c
-                join ocupaciones as o on o.cve_clientes = c.cve_clientes
-                join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
-                group by datename(month,dv.fecha_hora_salida)'''
-
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[1] for fila in resultados if isinstance(fila[1], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics    
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None) 
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Mes','Número_de_personas']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Mes', bar_y_col='Número_de_personas', hist_col='Número_de_personas', pie_index_col='Mes', pie_values_col='Número_de_personas',orientation='vertical')
-
-            elif consulta_seleccionada == 14:
-                consulta = '''
-                select top 10 m.nombre as Municipio,e.nombre as Estado,count(distinct c.cve_clientes) as Número_de_personas
-                from clientes as c
-                join municipios as m on m.cve_municipios = c.cve_municipios
-                join estados as e on e.cve_estados = m.cve_estados
-                join ocupaciones as o on o.cve_clientes = c.cve_clientes
-                group by m.nombre,e.nombre
-                order by count(distinct c.cve_clientes) desc'''
-
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[2] for fila in resultados if isinstance(fila[2], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None) 
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Municipio','Estado','Número_de_personas']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Municipio', bar_y_col='Número_de_personas', hist_col='Número_de_personas', pie_index_col='Municipio', pie_values_col='Número_de_personas',orientation='vertical')
-            elif consulta_seleccionada == 15:
-                consulta = '''
-                select top 10 m.nombre as Municipio,e.nombre as Estado,count(distinct c.cve_clientes) as Número_de_personas
-                from clientes as c
-                join municipios as m on m.cve_municipios = c.cve_municipios
-                join estados as e on e.cve_estados = m.cve_estados
-                join ocupaciones as o on o.cve_clientes = c.cve_clientes
-                group by m.nombre,e.nombre
-                order by count(distinct c.cve_clientes) asc'''
-
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[2] for fila in resultados if isinstance(fila[2], (int, float))]
-                
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-                #create data to graphics
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None) 
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Municipio','Estado','Número_de_personas']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Municipio', bar_y_col='Número_de_personas', hist_col='Número_de_personas', pie_index_col='Municipio', pie_values_col='Número_de_personas',orientation='vertical')
-
-            elif consulta_seleccionada == 16:
-                consulta = '''select a.nombre as Aeropuerto, ci.nombre as Cuidad, p.nombre as Pais, count(distinct c.cve_clientes) as Número_de_personas
-                from clientes as c
-                join ocupaciones as o on o.cve_clientes = c.cve_clientes
-                join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
-                join vuelos as v on v.cve_vuelos = dv.cve_vuelos
-                join aeropuertos a on a.cve_aeropuertos = v.cve_aeropuertos__destino
-                join ciudades as ci on ci.cve_ciudades = a.cve_ciudades
-                join paises as p on p.cve_paises = ci.cve_paises
-                group by a.nombre,ci.nombre,p.nombre
-                order by count(distinct c.cve_clientes) asc'''
-
-                #Do query and calculate the mode,median and mean
-                cursor.execute(consulta)
-                resultados = cursor.fetchall()
-                datos_numericos = [fila[3] for fila in resultados if isinstance(fila[3], (int, float))]
-                if datos_numericos:
-                    mode = statistics.mode(datos_numericos)
-                    mean = statistics.mean(datos_numericos)
-                    median = statistics.median(datos_numericos)
-                else:
-                    mode = mean = median = None
-
-                #create the data to create graphys
-                datos_adaptados = []
-                for fila in resultados:
-                    fila_adaptada = []
-                    for valor in fila:
-                        if isinstance(valor, (int, float, str)):
-                            fila_adaptada.append(valor)
-                        else:
-                            fila_adaptada.append(None)
-                    datos_adaptados.append(tuple(fila_adaptada))
-
-                print(datos_adaptados)
-                columnas = ['Aeropuerto','Cuidad','Pais','Número_de_personas']
-                try:
-                    df = pd.DataFrame(datos_adaptados, columns=columnas)
-                except Exception as e:
-                    print(f'Error al crear DataFrame: {e}')
-                    return {'error': str(e)}
-                graph_path_base = os.path.join('../','static/', 'graphs/', f'query_{consulta_seleccionada}')
-
-                bar_plot, hist_plot, pie_plot = generate_graphs_and_statistics(df, graph_path_base, bar_x_col='Aeropuerto', bar_y_col='Número_de_personas', hist_col='Número_de_personas', pie_index_col='Aeropuerto', pie_values_col='Número_de_personas',orientation='horizontal')
-            else:
-                print("Invalide ID")
-
-            end_time = time.time()
-            #time to do query---count the data---columns to results
-            columnas = [desc[0] for desc in cursor.description]
-            elapsed_time = end_time - start_time
-            count_data = len(resultados)
-
-            #close connection
-            cursor.close()          
-            
-            return render_template('query.html', id_query=consulta_seleccionada, name=query, columnas=columnas, resultados=resultados, time=elapsed_time, count=count_data,mode = mode, mean = mean, median = median, graph_dir=graph_path_base)
+            spec = spec.filtered(parse_filters(spec.filters, request.values))
+            contexto = run_query(spec, client_charts=use_client_charts())
+            elapsed_time = time.time() - start_time
+            with stage_timer.span('render', spec.id):
+                html = render_template('query.html', id_query=spec.id, name=spec.title, time=elapsed_time, etapas=stage_breakdown(current_trace()), **contexto)
+            #the render itself is only in the header, the page is already built
+            response = make_response(html)
+            response.headers['Server-Timing'] = server_timing(current_trace())
+            return response
+        except InvalidFilter as ex:
+            return {'error': str(ex)}, 400
+        except ValueError as e:
+            log.warning('Error al crear DataFrame: %s', e, extra={'fields': {'query': spec.id}})
+            return {'error': str(e)}
         except sql.Error as ex:
             sqlstate = ex.args[1]
             error_message = f"Error de conexión: {sqlstate}"
             return {'error': error_message}
+        except PoolTimeout as ex:
+            return {'error': str(ex)}, 503
+        except ServerBusy as ex:
+            return {'error': str(ex)}, 503, {'Retry-After': str(ex.retry_after)}
+        except QueryTimeout as ex:
+            return {'error': str(ex)}, 504
     else:
         return redirect(url_for('login_page'))
-#function to create graphys
-def generate_bar_chart(df, x_col, y_col, graph_path,orientation):
-    sns.barplot(x=x_col, y=y_col, data=df)
-
-    plt.xticks(fontsize=8,rotation=orientation) 
-    plt.title('Gráfico de Barras', fontsize=14)  
-    plt.xlabel(x_col, fontsize=12)  
-    plt.ylabel(y_col, fontsize=12)  
-    plt.tight_layout()
-    plt.savefig(graph_path)
-    plt.clf() 
-
-def generate_histogram(df, column, graph_path):
-    fig, ax = plt.subplots()
-    ax.hist(df[column], bins=10, linewidth=0.5, edgecolor="white")
-    ax.set_title('Histograma')
-    ax.set_xlabel(column, fontsize=10) 
-    ax.set_ylabel('Frequency')
-    plt.savefig(graph_path)
-    plt.clf()
-
-def generate_pie_chart(df, index_col, values_col, graph_path):
-    df.set_index(index_col)[values_col].plot.pie()
-    plt.title('Gráfico de pastel')
-    plt.ylabel('')
-    plt.savefig(graph_path)
-    plt.clf()
-
-def generate_graphs_and_statistics(df, graph_path_base, bar_x_col=None, bar_y_col=None, hist_col=None, pie_index_col=None, pie_values_col=None,orientation=None):
+
+# result of one report for the dashboard; the errors stay in its section and do not stop the others
+def load_dashboard_section(spec, conn_details, approximate=False):
+    start_time = time.time()
+    try:
+        resultado, origen, medidas = load_query_result(spec, conn_details, approximate=approximate)
+        return {
+            'spec': spec,
+            'columnas': resultado.columns,
+            'resultados': resultado.rows[:DASHBOARD_PREVIEW_ROWS],
+            'count': len(resultado.rows),
+            'medidas': medidas,
+            'origen': origen,
+            'approximate': resultado.approximate,
+            'time': time.time() - start_time,
+            'error': None,
+        }
+    except Exception as ex:
+        return {'spec': spec, 'time': time.time() - start_time, 'error': str(ex)}
+
+# run the reports in a pool of threads and give each section as soon as it is ready
+def run_dashboard(specs, conn_details, parallel, approximate=False):
+    executor = ThreadPoolExecutor(max_workers=parallel, thread_name_prefix='dashboard')
+    #each section runs in a copy of the context, so its log lines keep the id of the request
+    futures = {executor.submit(contextvars.copy_context().run, load_dashboard_section, spec, conn_details, approximate): spec for spec in specs}
+    start_time = time.time()
+    try:
+        for future in as_completed(futures, timeout=DASHBOARD_TIMEOUT_SECONDS):
+            yield future.result()
+    except FuturesTimeout:
+        for future, spec in futures.items():
+            if not future.done():
+                yield {'spec': spec, 'time': time.time() - start_time, 'error': 'Tiempo de espera agotado'}
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+#route to run several reports at the same time, the page is sent by parts as they finish
+@app.route('/dashboard')
+def dashboard():
+    if 'db_conn_details' not in session:
+        return redirect(url_for('login_page'))
+    ids = request.args.getlist('ids', type=int)
+    specs = [get_query(id) for id in ids if get_query(id)] if ids else list_specs()
+    conn_details = session['db_conn_details']
+    pool_size = connection_pools.get(conn_details).max_size
+    parallel = min(max(request.args.get('parallel', DASHBOARD_PARALLEL, type=int), 1), DASHBOARD_PARALLEL, pool_size)
+    start_time = time.time()
+    template = app.jinja_env.get_template('dashboard.html')
+    contenido = template.generate(
+        secciones=run_dashboard(specs, conn_details, parallel, use_approximate()),
+        total=len(specs),
+        parallel=parallel,
+        elapsed=lambda: time.time() - start_time,
+    )
+    return Response(stream_with_context(contenido), mimetype='text/html')
+
+# date of a snapshot for the result page
+@app.template_filter('snapshot_date')
+def snapshot_date(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime('%d/%m/%Y %H:%M:%S')
+
+# the graphs are drawn in the browser when CHARTS_MODE is client or the form asks for it
+def use_client_charts():
+    return request.values.get('charts', os.getenv('CHARTS_MODE', 'server')) == 'client'
+
+# approximate distinct counts when the form asks for them, or for every report with APPROX_DISTINCT=1
+def use_approximate():
+    return request.values.get('approx', os.getenv('APPROX_DISTINCT', '0')) == '1'
+
+#route with the result of a query as columnar json, used by the client charts
+@app.route('/api/query/<int:id>')
+def api_query(id):
+    spec = get_query(id)
+    if spec is None:
+        abort(404)
+    if 'db_conn_details' not in session:
+        return {'error': 'Sesión no iniciada'}, 401
+    try:
+        spec = spec.filtered(parse_filters(spec.filters, request.values))
+    except InvalidFilter as ex:
+        return {'error': str(ex)}, 400
+    try:
+        start_time = time.time()
+        resultado, origen, medidas = load_query_result(spec, session['db_conn_details'], approximate=use_approximate())
+        df = result_dataframe(spec, resultado)
+        tipos, datos = columnar_payload(df)
+        payload = {
+            'id': spec.id,
+            'title': spec.title,
+            'columns': list(df.columns),
+            'types': tipos,
+            'data': datos,
+            'count': len(df),
+            'measures': medidas,
+            'approximate': resultado.approximate,
+            'filters': {param: str(value) for param, value in spec.filter_values.items()},
+            'chart': spec.chart,
+            'timing': {
+                'total': time.time() - start_time,
+                'db_time': resultado.db_time,
+                'origen': origen,
+                'snapshot_at': resultado.snapshot_at,
+                'cached_at': resultado.created_at,
+            },
+        }
+        #the etag only depends on the cached result, so it does not change while the result is the same
+        etag = hashlib.sha1(f"{get_db_target()}|{spec.id}|{spec.filter_key}|{resultado.created_at}".encode('utf-8')).hexdigest()
+        return json_response(payload, request, etag=etag)
+    except sql.Error as ex:
+        return {'error': f"Error de conexión: {ex.args[1]}"}, 502
+    except PoolTimeout as ex:
+        return {'error': str(ex)}, 503
+    except ServerBusy as ex:
+        return {'error': str(ex)}, 503, {'Retry-After': str(ex.retry_after)}
+    except QueryTimeout as ex:
+        return {'error': str(ex)}, 504
+
+#route to download the full result of a query as csv, parquet or arrow, sent by parts as it is read;
+#a result already in the cache (or computed from the local stores) is sent from memory, the others
+#are read from the cursor without keeping them, so the memory does not grow with the rows
+@app.route('/api/query/<int:id>/export')
+def export_query(id):
+    spec = get_query(id)
+    if spec is None:
+        abort(404)
+    if 'db_conn_details' not in session:
+        return {'error': 'Sesión no iniciada'}, 401
+    formato = request.args.get('format', 'csv')
+    if formato not in available_formats():
+        return {'error': f'Formato no disponible: {formato}', 'formats': available_formats()}, 400
+    try:
+        spec = spec.filtered(parse_filters(spec.filters, request.args))
+    except InvalidFilter as ex:
+        return {'error': str(ex)}, 400
+    conn_details = session['db_conn_details']
+    database = db_target(conn_details)
+    try:
+        entry = cached_result(result_key(database, spec))[0]
+        if entry is None and (computed_locally(spec) or has_snapshot(database, spec)):
+            entry = fetch_query_results(spec, conn_details)[0]
+        if entry is not None:
+            description = None
+            columnas, batches = entry.columns, batches_of(entry.rows, FETCH_BATCH_SIZE)
+        else:
+            batches = stream_query(connection_pools.get(conn_details), database, spec)
+            #the query runs here, so its errors are still answered with their status
+            description = next(batches)
+            columnas = [column[0] for column in description]
+    except sql.Error as ex:
+        return {'error': f"Error de conexión: {ex.args[1]}"}, 502
+    except PoolTimeout as ex:
+        return {'error': str(ex)}, 503
+    except ServerBusy as ex:
+        return {'error': str(ex)}, 503, {'Retry-After': str(ex.retry_after)}
+    except QueryTimeout as ex:
+        return {'error': str(ex)}, 504
+
+    #parquet and arrow are already compressed inside, only the csv is compressed by the response
+    encoding = choose_encoding(request) if formato == 'csv' else None
+    chunks = compress_stream(export_chunks(columnas, batches, formato, description), encoding)
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[formato]['mimetype'])
+    response.headers['Content-Disposition'] = f"attachment; filename=query_{spec.id}.{EXPORT_FORMATS[formato]['extension']}"
+    response.headers['Cache-Control'] = 'private, no-store'
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    log.info('Exportación de la consulta %s', spec.id, extra={'fields': {'query': spec.id, 'format': formato, 'cached': entry is not None}})
+    return response
+
+# run a report with the snapshot connection and store it; on error the last snapshot stays in service
+def take_snapshot(spec):
+    database = db_target(SNAPSHOT_CONNECTION)
+    try:
+        columnas, resultados, db_time = compute_query(connection_pools.get(SNAPSHOT_CONNECTION), database, spec)
+        df = build_dataframe(resultados, spec.columns)
+        medidas = measures_of_tendency(df[spec.metric_column])
+        snapshot_store.save(database, spec.id, columnas, resultados, db_time, medidas)
+    except Exception as ex:
+        log.error('Error al actualizar la instantánea %s: %s', spec.id, ex, extra={'fields': {'query': spec.id}})
+        snapshot_store.record_failure(database, spec.id, ex)
+        raise
+    invalidate_results(database, spec.id)
+    #the graphs of the new snapshot are ready before the first visit
+    if os.getenv('CHARTS_MODE', 'server') != 'client':
+        generate_graphs_and_statistics(lambda: df, os.path.join('../','static/', 'graphs/', f'query_{spec.id}'), graph_digest(df, spec.chart), query_id=spec.id, **spec.chart)
+
+def snapshot_interval(spec):
+    return spec.refresh_interval or SNAPSHOT_INTERVAL_SECONDS
+
+snapshot_scheduler = SnapshotScheduler(take_snapshot, list_specs, snapshot_interval) if snapshot_store is not None else None
+
+# route to refresh the snapshot of a report now, then shows the report again
+@app.route('/snapshots/<int:id>/refresh', methods=['POST'])
+def refresh_snapshot(id):
+    spec = get_query(id)
+    if spec is None:
+        abort(404)
+    if 'db_conn_details' not in session:
+        return redirect(url_for('login_page'))
+    if snapshot_scheduler is None:
+        return {'error': 'Las instantáneas no están configuradas'}, 404
+    if not snapshot_scheduler.refresh_now(spec):
+        return {'error': 'No fue posible actualizar la instantánea, se conserva la anterior'}, 502
+    return redirect(url_for('visualizar_consulta', id=spec.id, name=spec.title), code=307)
+
+# route with the state of the snapshots
+@app.route('/snapshots')
+def snapshots_status():
+    if 'db_conn_details' not in session:
+        return redirect(url_for('login_page'))
+    if snapshot_store is None:
+        return {'snapshots': []}
+    estados = snapshot_store.status(db_target(SNAPSHOT_CONNECTION))
+    for estado in estados:
+        spec = get_query(estado['query_id'])
+        estado['next_due'] = snapshot_scheduler.next_due(spec) if spec else None
+    return {'snapshots': estados}
+
+# route to clear cached results of the current database (all queries or only one id)
+@app.route('/cache/invalidate', methods=['POST'])
+def invalidate_cache():
+    if 'db_conn_details' not in session:
+        return redirect(url_for('login_page'))
+    query_id = request.form.get('id', type=int)
+    removed = invalidate_results(get_db_target(), query_id)
+    spec = get_query(query_id) if query_id is not None else None
+    if fact_store is not None and (query_id is None or (spec is not None and spec.facts)):
+        fact_store.invalidate(get_db_target())
+    return {'invalidated': removed}
+
+# route to see the hit/miss counters of the cache
+@app.route('/cache/stats')
+def cache_stats():
+    if 'db_conn_details' not in session:
+        return redirect(url_for('login_page'))
+    stats = result_cache.stats()
+    if shared_store is not None:
+        stats['shared'] = shared_store.stats()
+    return stats
+
+# route with the worst slow executions of each query, with their plan, io and stages
+@app.route('/slow_queries')
+def slow_queries():
+    if 'db_conn_details' not in session:
+        return redirect(url_for('login_page'))
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    peores = slow_query_log.worst_offenders(limit) if slow_query_log is not None else []
+    for grupo in peores:
+        spec = get_query(grupo['query']) if grupo['query'] is not None else None
+        grupo['title'] = spec.title if spec else None
+    return render_template('slow_queries.html', peores=peores, enabled=slow_query_log is not None,
+                           stats=slow_query_log.stats() if slow_query_log is not None else None)
+
+# route to see the state of the connection pools
+@app.route('/pool/stats')
+def pool_stats():
+    if 'db_conn_details' not in session:
+        return redirect(url_for('login_page'))
+    return {'pools': connection_pools.stats(db_target), 'admission': admission.stats()}
+
+# histograms of the stages and requests plus the counters of the cache, in the prometheus text format
+@app.route('/metrics')
+def metrics():
+    cache = result_cache.stats()
+    contenido = ''.join([
+        stage_timer.histogram.render(),
+        request_seconds.render(),
+        render_values('app_cache_requests_total', 'Lookups of the result cache', 'counter',
+                      [({'result': 'hit'}, cache['hits']), ({'result': 'miss'}, cache['misses'])]),
+        render_values('app_cache_entries', 'Results in the cache', 'gauge', [({}, cache['entries'])]),
+        render_values('app_shared_results_bytes', 'Size of the files of the shared result store', 'gauge',
+                      [({}, shared_store.stats()['bytes'])] if shared_store is not None else []),
+        render_values('app_slow_queries_total', 'Executions written to the slow query log', 'counter',
+                      [({}, slow_query_log.recorded)] if slow_query_log is not None else []),
+        render_values('app_charts_pending', 'Graphs waiting in the render pool', 'gauge', [({}, chart_renderer.pending())]),
+        render_values('app_admission_rejected_total', 'Queries rejected because the database was busy', 'counter',
+                      [({'database': gate['database']}, gate['rejected']) for gate in admission.stats()]),
+        render_values('app_admission_waiting', 'Queries waiting for their turn on the database', 'gauge',
+                      [({'database': gate['database']}, gate['waiting']) for gate in admission.stats()]),
+        render_values('app_startup_seconds', 'Time to load the app', 'gauge', [({}, startup_seconds)]),
+        render_values('app_warmup_seconds', 'Time to load the data and plotting libraries in the background', 'gauge',
+                      [({}, warmup_thread.seconds)] if warmup_thread is not None and warmup_thread.seconds is not None else []),
+    ])
+    return Response(contenido, mimetype='text/plain; version=0.0.4')
+
+# hash of the result and of the parameters of the graphs; the name of the graph files depends on it,
+# so an existing file is already up to date. It takes every column of the report, like the reduction
+# that can group the bars by any other key of the result (the año of query 2)
+def graph_digest(df, chart):
+    return chart_digest(df, preset=CHART_PRESET, format=CHART_FORMAT, **chart, **CHART_LIMITS)
+
+# the graph of a name in the format it was drawn, when it is on disk or being drawn
+def existing_graph(name):
+    for fmt in GRAPH_FORMATS:
+        graph_path = f'{name}.{fmt}'
+        if graph_is_fresh(graph_path) or chart_renderer.status(graph_path)[0] == 'pending':
+            return graph_path
+    return None
+
+# graphs are sent to the pool of processes, the page asks for their status until they are ready;
+# load_df gives the dataframe, only called when a graph is not drawn yet
+def generate_graphs_and_statistics(load_df, graph_path_base, digest, query_id=None, bar_x_col=None, bar_y_col=None, hist_col=None, pie_index_col=None, pie_values_col=None,orientation=None):
 
     graph_dir = os.path.dirname(graph_path_base)
     if not os.path.exists(graph_dir):
         os.makedirs(graph_dir)
 
 
-    bar_plot_path = f"{graph_path_base}_bar_chart.png"
-    hist_plot_path = f"{graph_path_base}_hist.png"
-    pie_plot_path = f"{graph_path_base}_pie_chart.png"
-
-
+    preset = CHART_PRESETS[CHART_PRESET]
+    charts = {}
     if bar_x_col and bar_y_col:
-        generate_bar_chart(df, bar_x_col, bar_y_col, bar_plot_path,orientation)
+        charts['bar'] = dict(x_col=bar_x_col, y_col=bar_y_col, orientation=orientation)
     if hist_col:
-        generate_histogram(df, hist_col, hist_plot_path)
+        charts['hist'] = dict(column=hist_col)
     if pie_index_col and pie_values_col:
-        generate_pie_chart(df, pie_index_col, pie_values_col, pie_plot_path)
-        
-    print(bar_plot_path,hist_plot_path,pie_plot_path)
+        charts['pie'] = dict(index_col=pie_index_col, values_col=pie_values_col)
+
+    #the digest fixes the data, so the file of a graph in any format is the one that would be drawn;
+    #only the missing graphs get what they draw: the top categories plus Otros, the series of a second
+    #key and the bins of the histogram, so the time to draw it does not grow with the rows of the result
+    paths = {}
+    for kind, name in (('bar', 'bar_chart'), ('hist', 'hist'), ('pie', 'pie_chart')):
+        name = f'{graph_path_base}_{digest}_{name}'
+        paths[kind] = existing_graph(name)
+        if paths[kind] is not None:
+            continue
+        if kind not in charts:
+            paths[kind] = f'{name}.{choose_format(kind, 0, CHART_FORMAT)}'
+            continue
+        data, args = reduce_chart(kind, load_df(), charts[kind], **CHART_LIMITS)
+        fmt = choose_format(kind, len(data), CHART_FORMAT)
+        paths[kind] = f'{name}.{fmt}'
+        chart_renderer.submit(kind, data, query_id=query_id, graph_path=paths[kind], fmt=fmt, **args, **preset)
+    bar_plot_path, hist_plot_path, pie_plot_path = paths['bar'], paths['hist'], paths['pie']
+
+    graph_sweeper.maybe_sweep()
+    log.debug('Gráficos %s %s %s', bar_plot_path, hist_plot_path, pie_plot_path)
     return bar_plot_path, hist_plot_path, pie_plot_path, 
 
+# size in pixels of the graphs, for the width and height of the images
+def graph_size():
+    preset = CHART_PRESETS[CHART_PRESET]
+    return int(preset['size'][0] * preset['dpi']), int(preset['size'][1] * preset['dpi'])
+
+# path of a graph relative to the static folder, to build its url in the template
+def static_filename(graph_path):
+    return os.path.relpath(os.path.abspath(graph_path), app.static_folder).replace(os.sep, '/')
+
+# route of the graph files with a strong etag from their name (it has the hash of the data) and a
+# long immutable cache, the browser only downloads a graph once
+@app.route('/graphs/<string:filename>')
+def graph_file(filename):
+    extension = os.path.splitext(filename)[1]
+    if extension not in GRAPH_MIMETYPES:
+        abort(404)
+    response = send_from_directory(graph_sweeper.graph_dir, filename, mimetype=GRAPH_MIMETYPES[extension], conditional=False, etag=False)
+    response.set_etag(hashlib.sha1(filename.encode('utf-8')).hexdigest())
+    response.headers['Cache-Control'] = GRAPH_CACHE_CONTROL
+    return response.make_conditional(request)
+
+# route to know if a graph is ready, used by the page to replace the placeholders
+@app.route('/graphs/status')
+def graph_status():
+    filename = request.args.get('file', '')
+    graph_path = os.path.abspath(os.path.join(app.static_folder, filename))
+    if os.path.dirname(graph_path) != os.path.abspath(graph_sweeper.graph_dir):
+        abort(404)
+    status, error = chart_renderer.status(graph_path)
+    return {'status': status, 'error': error}
+
+# the data and plotting libraries are loaded by the first query; with WARMUP=1 they are loaded
+# in the background once the server is running, and the processes of the graphs are started
+WARMUP = os.getenv('WARMUP') == '1'
+warmup_thread = None
+
+def start_warmup():
+    global warmup_thread
+    if warmup_thread is None:
+        from charts import plt, sns
+        from measures import np, pd
+        warmup_thread = warm_up([sql, pd, np, plt, sns], steps=[chart_renderer.warm_up])
+    return warmup_thread
+
+startup_seconds = time.perf_counter() - STARTUP_BEGIN
+log.info('Aplicación cargada en %.3f segundos', startup_seconds, extra={'fields': {'seconds': round(startup_seconds, 3)}})
+
 if __name__ == '__main__':
+    #the reloader runs this file twice, the scheduler only starts in the process that serves
+    if snapshot_scheduler is not None and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        snapshot_scheduler.start()
+    if WARMUP and os.getenv('WERKZEUG_RUN_MAIN') == 'true':
+        start_warmup()
     app.run(debug=True)
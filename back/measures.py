@@ -0,0 +1,71 @@
+from lazy import LazyModule
+
+# pandas and numpy are loaded by the first result, the login and index pages do not need them
+np = LazyModule('numpy')
+pd = LazyModule('pandas')
+
+
+# build the dataframe column by column; numbers become numeric columns, text stays as text
+# and any other type (dates, binary) becomes None like the old row by row adaptation;
+# only keeps the given columns when there are
+def build_dataframe(rows, columns, only=None):
+    #the rows of the shared store are an arrow table, it is converted by columns and only the ones needed
+    if hasattr(rows, 'to_pandas'):
+        indices = [columns.index(column) for column in only] if only else range(len(columns))
+        df = rows.to_pandas(indices)
+        df.columns = [columns[index] for index in indices]
+    else:
+        df = pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+        if only:
+            df = df[list(only)]
+    for column in df.columns:
+        values = df[column]
+        if values.dtype != object:
+            continue
+        kind = pd.api.types.infer_dtype(values, skipna=True)
+        if kind in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+            df[column] = pd.to_numeric(values, errors='coerce')
+        elif kind not in ('string', 'empty'):
+            df[column] = values.where(values.map(type).isin((str, int, float)), None)
+    return df
+
+
+# mode, mean and median of the metric column plus dispersion measures, computed on the numeric values
+def measures_of_tendency(series):
+    numeric = pd.to_numeric(series, errors='coerce').dropna()
+    if numeric.empty:
+        return dict.fromkeys(['mode', 'mean', 'median', 'std', 'min', 'max', 'p25', 'p75'])
+
+    # the mode is the first value with the highest frequency, as statistics.mode does
+    counts = numeric.value_counts(sort=False)
+    values = numeric.to_numpy(dtype=float)
+    p25, median, p75 = np.percentile(values, [25, 50, 75])
+    return {
+        'mode': _as_python(counts.idxmax()),
+        'mean': float(values.mean()),
+        'median': _as_python(median),
+        'std': float(values.std(ddof=1)) if len(values) > 1 else None,
+        'min': _as_python(numeric.min()),
+        'max': _as_python(numeric.max()),
+        'p25': float(p25),
+        'p75': float(p75),
+    }
+
+
+# numpy scalars to python numbers, integers stay integers so the page shows 12 and not 12.0
+def _as_python(value):
+    value = value.item() if hasattr(value, 'item') else value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+# columns of the dataframe as lists with their type, NaN as None so the result is valid json
+def columnar_payload(df):
+    tipos = []
+    datos = []
+    for column in df.columns:
+        values = df[column]
+        tipos.append('number' if pd.api.types.is_numeric_dtype(values) else 'string')
+        datos.append(values.astype(object).where(values.notna(), None).tolist())
+    return tipos, datos
@@ -0,0 +1,109 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# upper bounds in seconds of the buckets, from a fast cache hit to a slow report
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# spans of the current request, None outside of a traced request (background threads)
+_trace = ContextVar('trace', default=None)
+
+
+# cumulative histogram by labels in the prometheus text format
+class Histogram:
+    def __init__(self, name, description, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def _labels(self, labels, **extra):
+        pares = list(zip(self.label_names, labels)) + list(extra.items())
+        return ','.join(f'{name}="{_escape(value)}"' for name, value in pares)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(data['buckets']), data['sum'], data['count']) for labels, data in self._series.items()}
+        for labels, (buckets, total, count) in sorted(series.items()):
+            acumulado = 0
+            for bound, value in zip(self.buckets, buckets):
+                acumulado += value
+                lines.append(f'{self.name}_bucket{{{self._labels(labels, le=bound)}}} {acumulado}')
+            lines.append(f'{self.name}_bucket{{{self._labels(labels, le="+Inf")}}} {count}')
+            lines.append(f'{self.name}_sum{{{self._labels(labels)}}} {total}')
+            lines.append(f'{self.name}_count{{{self._labels(labels)}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# counters and gauges from a dict of values, like the stats of the cache or the pools
+def render_values(name, description, kind, values):
+    lines = [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+    for labels, value in values:
+        etiquetas = ','.join(f'{label}="{_escape(valor)}"' for label, valor in labels.items())
+        lines.append(f'{name}{{{etiquetas}}} {value}' if etiquetas else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# time of each stage of the pipeline by query id; the spans also go to the trace of the request
+class StageTimer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    # the labels are text like in prometheus, so the series of any caller sort together
+    def observe(self, stage, query_id, seconds):
+        self.histogram.observe(seconds, stage, '' if query_id is None else str(query_id))
+        spans = _trace.get()
+        if spans is not None:
+            spans.append((stage, seconds))
+
+    @contextmanager
+    def span(self, stage, query_id=None):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, query_id, time.perf_counter() - start_time)
+
+
+# start collecting the spans of the current request
+def start_trace():
+    spans = []
+    _trace.set(spans)
+    return spans
+
+
+def current_trace():
+    return _trace.get() or []
+
+
+# total time of each stage in the order they happened, a stage that runs twice is added up
+def stage_breakdown(spans):
+    totales = {}
+    for stage, seconds in spans:
+        totales[stage] = totales.get(stage, 0.0) + seconds
+    return list(totales.items())
+
+
+# value of the Server-Timing header, so the browser devtools show the stages too
+def server_timing(spans):
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in stage_breakdown(spans))
@@ -0,0 +1,242 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+# idle connection with the time it was returned and the last time it was known to work
+class _IdleConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.returned_at = time.time()
+        self.checked_at = self.returned_at
+
+
+# pool of connections to one connection string
+class ConnectionPool:
+    def __init__(self, connect, min_size=1, max_size=5, idle_timeout=300, checkout_timeout=30, health_check_interval=30):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._in_use = 0
+        self._closed = False
+        self._discard = set()
+        self._cond = threading.Condition()
+        self.last_used = time.time()
+        self.created = 0
+        self.discarded = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def acquire(self):
+        start = time.time()
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeout('El pool de conexiones fue cerrado')
+                self._reap_idle()
+                if self._idle:
+                    idle = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use < self.max_size:
+                    idle = None
+                    self._in_use += 1
+                    break
+                remaining = self.checkout_timeout - (time.time() - start)
+                if remaining <= 0:
+                    raise PoolTimeout('No hay conexiones disponibles, intente de nuevo')
+                waited = True
+                self._cond.wait(remaining)
+            self.checkouts += 1
+            if waited:
+                elapsed = time.time() - start
+                self.waits += 1
+                self.wait_time += elapsed
+                self.max_wait_time = max(self.max_wait_time, elapsed)
+
+        # connect and health check outside of the lock, they talk to the server
+        try:
+            if idle is not None and self._is_healthy(idle):
+                return idle.conn
+            if idle is not None:
+                self._close(idle.conn)
+            conn = self._connect()
+            with self._cond:
+                self.created += 1
+            return conn
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn, broken=False):
+        with self._cond:
+            self._in_use -= 1
+            if broken or self._closed or id(conn) in self._discard:
+                self._discard.discard(id(conn))
+                self._close(conn)
+            else:
+                self._idle.append(_IdleConnection(conn))
+            self._cond.notify()
+
+    # a connection in use that was left in a state the next user can not work with (without an
+    # error of the query that used it) is closed when it is returned instead of kept
+    def discard(self, conn):
+        with self._cond:
+            self._discard.add(id(conn))
+
+    # return the connection to the pool, or discard it if the error says it is broken
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        #finally also covers a generator closed in the middle, like an export the client stopped downloading
+        try:
+            yield conn
+        except Exception as ex:
+            broken = _is_disconnect(ex)
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    # open connections in the background until the pool has min_size of them
+    def prefill(self):
+        def fill():
+            with self._cond:
+                missing = self.min_size - len(self._idle) - self._in_use
+                self._in_use += max(missing, 0)
+            for _ in range(max(missing, 0)):
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._in_use -= 1
+                        self._cond.notify()
+                    continue
+                with self._cond:
+                    self.created += 1
+                self.release(conn)
+        threading.Thread(target=fill, daemon=True).start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        for item in idle:
+            self._close(item.conn)
+
+    # nothing in use and nobody asked for the pool in idle_timeout, the sessions of its connection
+    # string are gone (a logout or an expired cookie) and its connections can be closed
+    def is_abandoned(self, now):
+        with self._cond:
+            return self._in_use == 0 and now - self.last_used > self.idle_timeout
+
+    # a pool that never opened a connection, like the one of a login that failed
+    def is_empty(self):
+        with self._cond:
+            return self._in_use == 0 and not self._idle
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'created': self.created,
+                'discarded': self.discarded,
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+            }
+
+    # close connections idle for longer than idle_timeout, keeping min_size open
+    def _reap_idle(self):
+        now = time.time()
+        keep = []
+        for item in sorted(self._idle, key=lambda item: item.returned_at, reverse=True):
+            if now - item.returned_at > self.idle_timeout and len(keep) + self._in_use >= self.min_size:
+                self._close(item.conn)
+            else:
+                keep.append(item)
+        self._idle = keep[::-1]
+
+    def _is_healthy(self, idle):
+        if time.time() - idle.checked_at < self.health_check_interval:
+            return True
+        try:
+            cursor = idle.conn.cursor()
+            cursor.execute('select 1')
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        self.discarded += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# ODBC class 08 is a connection exception, the connection can not be reused
+def _is_disconnect(ex):
+    args = getattr(ex, 'args', ())
+    return bool(args) and isinstance(args[0], str) and args[0].startswith('08')
+
+
+# one pool for each connection string; the sessions that use a pool are not known (a session can
+# log in in one process and out in another), so a pool is closed when it is abandoned and not
+# when a session of its connection string ends
+class PoolManager:
+    def __init__(self, connect, **pool_options):
+        self._connect = connect
+        self._pool_options = pool_options
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def get(self, conn_details):
+        abandoned = []
+        with self._lock:
+            now = time.time()
+            for details, pool in list(self._pools.items()):
+                if details != conn_details and pool.is_abandoned(now):
+                    abandoned.append(self._pools.pop(details))
+            pool = self._pools.get(conn_details)
+            if pool is None:
+                pool = ConnectionPool(lambda: self._connect(conn_details), **self._pool_options)
+                self._pools[conn_details] = pool
+            pool.last_used = now
+        for old in abandoned:
+            old.close()
+        return pool
+
+    # forget the pool of a connection string that could not connect, only if it has no connection:
+    # other sessions with the same string keep theirs
+    def discard_empty(self, conn_details):
+        with self._lock:
+            pool = self._pools.get(conn_details)
+            if pool is not None and pool.is_empty():
+                del self._pools[conn_details]
+
+    # statistics of every pool, describe turns the connection string into a name without credentials
+    def stats(self, describe):
+        with self._lock:
+            pools = list(self._pools.items())
+        return [dict(pool.stats(), database=describe(conn_details)) for conn_details, pool in pools]
@@ -0,0 +1,502 @@
+import copy
+import json
+
+from approx import has_count_distinct
+from filters import FILTER_PARAMS, add_where, filter_key, filter_predicates
+
+
+# description of one registered query: sql, columns of the dataframe, column used for the
+# measures of tendency, arguments of the graphs, a hint of how expensive it is to run,
+# every how many seconds its snapshot is refreshed (None uses the default interval), the
+# report of incremental.py that can compute it from stored (year, month) aggregates and the
+# report of facts.py that can compute it from the shared facts of the occupations; the cost
+# also sets its time limit and its share of the database, unless it has its own timeout; filters
+# gives the column of each filter of filters.py the report accepts
+class QuerySpec:
+    def __init__(self, id, title, sql, columns, metric_column, chart=None, cost='medium', refresh_interval=None, incremental=None, facts=None, timeout=None, filters=None):
+        self.id = id
+        self.title = title
+        self.sql = sql
+        self.columns = list(columns)
+        self.metric_column = metric_column
+        self.chart = dict(chart or {})
+        self.cost = cost
+        self.refresh_interval = refresh_interval
+        self.incremental = incremental
+        self.facts = facts
+        self.timeout = timeout
+        self.filters = dict(filters or {})
+        self.params = ()
+        self.filter_values = {}
+        if metric_column not in self.columns:
+            raise ValueError(f"La columna {metric_column} no está en las columnas de la consulta {id}")
+        for name in self.filters:
+            if name not in FILTER_PARAMS:
+                raise ValueError(f"Filtro desconocido {name} en la consulta {id}")
+
+    @property
+    def metric_index(self):
+        return self.columns.index(self.metric_column)
+
+    # the reports with a count(distinct ...) can be computed with an approximate count
+    @property
+    def approximable(self):
+        return has_count_distinct(self.sql)
+
+    @property
+    def filter_key(self):
+        return filter_key(self.filter_values)
+
+    # the same report with the filters applied: its sql with a placeholder for each value and the
+    # values as parameters; it always runs in the database, the snapshots and the local stores
+    # only have the full report
+    def filtered(self, filtros):
+        if not filtros:
+            return self
+        predicates, params = filter_predicates(self.filters, filtros)
+        spec = copy.copy(self)
+        spec.sql = add_where(self.sql, predicates)
+        spec.params = tuple(params)
+        spec.filter_values = dict(filtros)
+        spec.incremental = spec.facts = spec.refresh_interval = None
+        return spec
+
+
+QUERIES = {}
+
+
+def register_query(spec):
+    QUERIES[spec.id] = spec
+    return spec
+
+
+def get_query(query_id):
+    return QUERIES.get(query_id)
+
+
+def list_specs():
+    return sorted(QUERIES.values(), key=lambda spec: spec.id)
+
+
+# id and title of every registered query, in the order they are shown in the index
+def list_queries():
+    return [[spec.id, spec.title] for spec in list_specs()]
+
+
+# register the queries of a json file with a list of objects with the arguments of QuerySpec
+def load_queries_file(path):
+    with open(path, encoding='utf-8') as file:
+        definitions = json.load(file)
+    return [register_query(QuerySpec(**definition)) for definition in definitions]
+
+
+for _spec in [
+    QuerySpec(
+        id=1,
+        title='Número de personas que viajaron por cada estado',
+        sql='''
+            select e.nombre as Estados, count(o.cve_clientes) as Número_de_personas_que_viajaron
+            from Ocupaciones as o
+            join clientes as c on o.cve_clientes = c.cve_clientes
+            join estados as e on c.cve_estados = e.cve_estados
+            group by e.nombre
+            order by Número_de_personas_que_viajaron desc
+        ''',
+        columns=['Estados', 'Número_de_personas_que_viajaron'],
+        metric_column='Número_de_personas_que_viajaron',
+        chart=dict(
+            bar_x_col='Estados',
+            bar_y_col='Número_de_personas_que_viajaron',
+            hist_col='Número_de_personas_que_viajaron',
+            pie_index_col='Estados',
+            pie_values_col='Número_de_personas_que_viajaron',
+            orientation='vertical',
+        ),
+        cost='medium',
+        filters=dict(estado='e.nombre'),
+        facts='personas_por_estado',
+    ),
+    QuerySpec(
+        id=2,
+        title='Número de personas que viajaron por cada estado, por cada año',
+        sql='''
+            select e.nombre as Estado, year(dv.fecha_hora_salida) as año,count(distinct o.cve_clientes) as Número_personas_que_viajaron
+            from ocupaciones as o
+            join clientes as c on o.cve_clientes = c.cve_clientes
+            join estados as e on c.cve_estados = e.cve_estados
+            join detalle_vuelos as dv ON o.cve_detalle_vuelos = dv.cve_detalle_vuelos
+            group by e.nombre, YEAR(dv.fecha_hora_salida)
+        ''',
+        columns=['Estado', 'año', 'Número_de_personas_que_viajaron'],
+        metric_column='Número_de_personas_que_viajaron',
+        chart=dict(
+            bar_x_col='Estado',
+            bar_y_col='Número_de_personas_que_viajaron',
+            hist_col='Número_de_personas_que_viajaron',
+            pie_index_col='Estado',
+            pie_values_col='Número_de_personas_que_viajaron',
+            orientation='vertical',
+        ),
+        cost='high',
+        filters=dict(fecha='dv.fecha_hora_salida', estado='e.nombre'),
+        facts='personas_por_estado_año',
+    ),
+    QuerySpec(
+        id=3,
+        title='Número de personas que viajaron de cada combinación municipios, estado',
+        sql='''
+            select e.nombre as Estado, m.nombre as Municipio, count(c.cve_clientes) as Número_de_persona
+            from clientes as c
+            join ocupaciones as o on o.cve_clientes = c.cve_clientes
+            join estados as e on e.cve_estados = c.cve_estados
+            join municipios as m on e.cve_estados = m.cve_estados and m.cve_estados = c.cve_estados
+            group by e.nombre, m.nombre
+            order by e.nombre
+        ''',
+        columns=['Estado', 'Municipio', 'Número_de_persona'],
+        metric_column='Número_de_persona',
+        chart=dict(
+            bar_x_col='Estado',
+            bar_y_col='Número_de_persona',
+            hist_col='Número_de_persona',
+            pie_index_col='Estado',
+            pie_values_col='Número_de_persona',
+            orientation='vertical',
+        ),
+        cost='high',
+        filters=dict(estado='e.nombre'),
+    ),
+    QuerySpec(
+        id=4,
+        title='Número de vuelos por cada año',
+        sql='''
+            select  year(dv.fecha_hora_salida) as Año,count(dv.cve_vuelos) as Número_de_vuelos
+            from detalle_vuelos as dv
+            group by year(dv.fecha_hora_salida)
+        ''',
+        columns=['Año', 'Número_de_vuelos'],
+        metric_column='Número_de_vuelos',
+        chart=dict(
+            bar_x_col='Año',
+            bar_y_col='Número_de_vuelos',
+            hist_col='Número_de_vuelos',
+            pie_index_col='Año',
+            pie_values_col='Número_de_vuelos',
+            orientation='horizontal',
+        ),
+        cost='low',
+        filters=dict(fecha='dv.fecha_hora_salida'),
+        incremental='vuelos_por_año',
+    ),
+    QuerySpec(
+        id=5,
+        title='Número de vuelos por cada mes año',
+        sql='''
+            select datename(month,dv.fecha_hora_salida) as Mes, year(dv.fecha_hora_salida) as Año, count(dv.cve_vuelos) as Número_de_vuelos
+            from detalle_vuelos as dv
+            group by datename(month,dv.fecha_hora_salida),year(dv.fecha_hora_salida)
+        ''',
+        columns=['Mes', 'Año', 'Número_de_vuelos'],
+        metric_column='Número_de_vuelos',
+        chart=dict(
+            bar_x_col='Mes',
+            bar_y_col='Número_de_vuelos',
+            hist_col='Número_de_vuelos',
+            pie_index_col='Mes',
+            pie_values_col='Número_de_vuelos',
+            orientation='vertical',
+        ),
+        cost='low',
+        filters=dict(fecha='dv.fecha_hora_salida'),
+        incremental='vuelos_por_mes_año',
+    ),
+    QuerySpec(
+        id=6,
+        title='Número de personas que viajaron de acuerdo a su categoría: Niños hasta 12 años, adolescentes de 13 a 17 años, jóvenes de 18 a 30 años, adultos de 30 a 59 años y adultos mayores de 60 en adelante',
+        sql='''
+            select case
+            when datediff(year, c.fecha_nacimiento,getdate()) <= 12 then 'Niños hasta 12 años'
+            when datediff(year, c.fecha_nacimiento, getdate()) between 13 and 17 then 'Adolescentes de 13 a 17 años'
+            when datediff(year, c.fecha_nacimiento, getdate()) between 18 and 30 then 'Jóvenes de 18 a 30 años'
+            when datediff(year, c.fecha_nacimiento, getdate()) between 31 and 59 then 'Adultos de 31 a 59 años'
+            else 'Adultos mayores de 60 años' end as Categoría_de_edad, count(distinct c.cve_clientes) as número_de_personas
+            from clientes as c
+            join ocupaciones as o on c.cve_clientes = o.cve_clientes
+            group by case
+            when datediff(year, c.fecha_nacimiento,getdate()) <= 12 then 'Niños hasta 12 años'
+            when datediff(year, c.fecha_nacimiento, getdate()) between 13 and 17 then 'Adolescentes de 13 a 17 años'
+            when datediff(year, c.fecha_nacimiento, getdate()) between 18 and 30 then 'Jóvenes de 18 a 30 años'
+            when datediff(year, c.fecha_nacimiento, getdate()) between 31 and 59 then 'Adultos de 31 a 59 años'
+            else 'Adultos mayores de 60 años'
+            end
+        ''',
+        columns=['Categoría_de_edad', 'número_de_personas'],
+        metric_column='número_de_personas',
+        chart=dict(
+            bar_x_col='Categoría_de_edad',
+            bar_y_col='número_de_personas',
+            hist_col='número_de_personas',
+            pie_index_col='Categoría_de_edad',
+            pie_values_col='número_de_personas',
+            orientation='vertical',
+        ),
+        cost='medium',
+        facts='personas_por_categoria',
+    ),
+    QuerySpec(
+        id=7,
+        title='Número de vuelos por cada aeropuerto de salida en cada año, del aeropuerto se desea saber la clave internacional del aeropuerto y la clave internacional del país al que pertenece el aeropuerto',
+        sql='''
+            select year(dv.fecha_hora_salida) as Año, a.clave_internacional as Clave_internacional, p.clave_internacional as Clave_internacional_del_pais,
+            count(dv.cve_vuelos) as Número_de_vuelos
+            from detalle_vuelos as dv
+            join vuelos as v on dv.cve_vuelos = v.cve_vuelos
+            join aeropuertos as a on v.cve_aeropuertos__origen = a.cve_aeropuertos
+            join ciudades as c on a.cve_ciudades = c.cve_ciudades
+            join paises as p on c.cve_paises = p.cve_paises
+            group by year(dv.fecha_hora_salida), a.clave_internacional, p.clave_internacional
+            order by año,a.clave_internacional
+        ''',
+        columns=['Año', 'Clave_internacional', 'Clave_internacional_del_pais', 'Número_de_vuelos'],
+        metric_column='Número_de_vuelos',
+        chart=dict(
+            bar_x_col='Año',
+            bar_y_col='Número_de_vuelos',
+            hist_col='Número_de_vuelos',
+            pie_index_col='Año',
+            pie_values_col='Número_de_vuelos',
+            orientation='horizontal',
+        ),
+        cost='high',
+        filters=dict(fecha='dv.fecha_hora_salida', aeropuerto='a.clave_internacional'),
+    ),
+    QuerySpec(
+        id=8,
+        title='Número de vuelos por aerolínea (detalle_vuelos)',
+        sql='''
+            select a.nombre as Aerolínea,count(dv.cve_detalle_vuelos) as Número_de_vuelos
+            from detalle_vuelos as dv
+            join vuelos as v on dv.cve_vuelos = v.cve_vuelos
+            join aerolineas as a on v.cve_aerolineas = a.cve_aerolineas
+            group by a.nombre
+        ''',
+        columns=['Aerolínea', 'Número_de_vuelos'],
+        metric_column='Número_de_vuelos',
+        chart=dict(
+            bar_x_col='Aerolínea',
+            bar_y_col='Número_de_vuelos',
+            hist_col='Número_de_vuelos',
+            pie_index_col='Aerolínea',
+            pie_values_col='Número_de_vuelos',
+            orientation='horizontal',
+        ),
+        cost='low',
+        filters=dict(fecha='dv.fecha_hora_salida', aerolinea='a.nombre'),
+    ),
+    QuerySpec(
+        id=9,
+        title='Número de vuelos realizados por aerolínea, por cada año',
+        sql='''
+            select a.nombre as Aerolíneas, year(dv.fecha_hora_salida) as Año,count(dv.cve_detalle_vuelos) as Número_de_vuelos
+            from detalle_vuelos as dv
+            join vuelos as v on dv.cve_vuelos = v.cve_vuelos
+            join aerolineas as a on v.cve_aerolineas = a.cve_aerolineas
+            group by a.nombre, year(dv.fecha_hora_salida)
+        ''',
+        columns=['Aerolíneas', 'Año', 'Número_de_vuelos'],
+        metric_column='Número_de_vuelos',
+        chart=dict(
+            bar_x_col='Aerolíneas',
+            bar_y_col='Número_de_vuelos',
+            hist_col='Número_de_vuelos',
+            pie_index_col='Aerolíneas',
+            pie_values_col='Número_de_vuelos',
+            orientation='horizontal',
+        ),
+        cost='low',
+        filters=dict(fecha='dv.fecha_hora_salida', aerolinea='a.nombre'),
+        incremental='vuelos_por_aerolinea_año',
+    ),
+    QuerySpec(
+        id=10,
+        title='Número de personas que viajan por cada estado, muestre los 10 estados a los que más personas viajan',
+        sql='''
+            select top 10 e.nombre as Estado ,count(distinct o.cve_clientes) as Número_de_personas
+            from clientes as c
+            join ocupaciones as o on o.cve_clientes = c.cve_clientes
+            join estados as e on e.cve_estados = c.cve_estados
+            group by e.nombre
+            order by Número_de_personas desc
+        ''',
+        columns=['Estado', 'Número_de_personas'],
+        metric_column='Número_de_personas',
+        chart=dict(
+            bar_x_col='Estado',
+            bar_y_col='Número_de_personas',
+            hist_col='Número_de_personas',
+            pie_index_col='Estado',
+            pie_values_col='Número_de_personas',
+            orientation='vertical',
+        ),
+        cost='medium',
+        facts='top_estados',
+    ),
+    QuerySpec(
+        id=11,
+        title='Número de personas que viajan por cada año',
+        sql='''
+            select count(o.cve_clientes) as Número_de_personas, year(dv.fecha_hora_salida) as Año
+            from clientes as c
+            join ocupaciones as o on o.cve_clientes = c.cve_clientes
+            join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
+            group by year(dv.fecha_hora_salida)
+        ''',
+        columns=['Número_de_personas', 'Año'],
+        metric_column='Número_de_personas',
+        chart=dict(
+            bar_x_col='Año',
+            bar_y_col='Número_de_personas',
+            hist_col='Número_de_personas',
+            pie_index_col='Año',
+            pie_values_col='Número_de_personas',
+            orientation='horizontal',
+        ),
+        cost='medium',
+        filters=dict(fecha='dv.fecha_hora_salida'),
+        incremental='personas_por_año',
+        facts='personas_por_año',
+    ),
+    QuerySpec(
+        id=12,
+        title='Nombre, ciudad y país de los 10 aeropuertos de los que más personas parten hacia algún destino',
+        sql='''
+            select top 10 a.nombre as Aeropuerto, ci.nombre as Cuidad,p.nombre as País,count(distinct c.cve_clientes) as Número_de_personas
+            from clientes as c
+            join ocupaciones as o on o.cve_clientes = c.cve_clientes
+            join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
+            join vuelos as v on v.cve_vuelos = dv.cve_vuelos
+            join aeropuertos as a on a.cve_aeropuertos = v.cve_aeropuertos__origen
+            join ciudades as ci on ci.cve_ciudades = a.cve_ciudades
+            join paises as p on p.cve_paises = ci.cve_paises
+            group by a.nombre, ci.nombre, p.nombre
+        ''',
+        columns=['Aeropuerto', 'Cuidad', 'País', 'Número_de_personas'],
+        metric_column='Número_de_personas',
+        chart=dict(
+            bar_x_col='Aeropuerto',
+            bar_y_col='Número_de_personas',
+            hist_col='Número_de_personas',
+            pie_index_col='Aeropuerto',
+            pie_values_col='Número_de_personas',
+            orientation='horizontal',
+        ),
+        cost='high',
+        filters=dict(fecha='dv.fecha_hora_salida'),
+    ),
+    QuerySpec(
+        id=13,
+        title='Número de personas que viajan por cada mes',
+        sql='''
+            select datename(month,dv.fecha_hora_salida) as Mes,count(distinct c.cve_clientes) as Número_de_personas
+            from clientes as c
+            join ocupaciones as o on o.cve_clientes = c.cve_clientes
+            join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
+            group by datename(month,dv.fecha_hora_salida)
+        ''',
+        columns=['Mes', 'Número_de_personas'],
+        metric_column='Número_de_personas',
+        chart=dict(
+            bar_x_col='Mes',
+            bar_y_col='Número_de_personas',
+            hist_col='Número_de_personas',
+            pie_index_col='Mes',
+            pie_values_col='Número_de_personas',
+            orientation='vertical',
+        ),
+        cost='medium',
+        filters=dict(fecha='dv.fecha_hora_salida'),
+        incremental='personas_por_mes',
+        facts='personas_por_mes',
+    ),
+    QuerySpec(
+        id=14,
+        title='Nombre de los 10 municipios de los que más personas viajan, agregue el nombre del estado',
+        sql='''
+            select top 10 m.nombre as Municipio,e.nombre as Estado,count(distinct c.cve_clientes) as Número_de_personas
+            from clientes as c
+            join municipios as m on m.cve_municipios = c.cve_municipios
+            join estados as e on e.cve_estados = m.cve_estados
+            join ocupaciones as o on o.cve_clientes = c.cve_clientes
+            group by m.nombre,e.nombre
+            order by count(distinct c.cve_clientes) desc
+        ''',
+        columns=['Municipio', 'Estado', 'Número_de_personas'],
+        metric_column='Número_de_personas',
+        chart=dict(
+            bar_x_col='Municipio',
+            bar_y_col='Número_de_personas',
+            hist_col='Número_de_personas',
+            pie_index_col='Municipio',
+            pie_values_col='Número_de_personas',
+            orientation='vertical',
+        ),
+        cost='medium',
+        filters=dict(estado='e.nombre'),
+        facts='top_municipios',
+    ),
+    QuerySpec(
+        id=15,
+        title='Nombre de los 10 municipios de los que menos personas viajan, agregue el nombre del estado',
+        sql='''
+            select top 10 m.nombre as Municipio,e.nombre as Estado,count(distinct c.cve_clientes) as Número_de_personas
+            from clientes as c
+            join municipios as m on m.cve_municipios = c.cve_municipios
+            join estados as e on e.cve_estados = m.cve_estados
+            join ocupaciones as o on o.cve_clientes = c.cve_clientes
+            group by m.nombre,e.nombre
+            order by count(distinct c.cve_clientes) asc
+        ''',
+        columns=['Municipio', 'Estado', 'Número_de_personas'],
+        metric_column='Número_de_personas',
+        chart=dict(
+            bar_x_col='Municipio',
+            bar_y_col='Número_de_personas',
+            hist_col='Número_de_personas',
+            pie_index_col='Municipio',
+            pie_values_col='Número_de_personas',
+            orientation='vertical',
+        ),
+        cost='medium',
+        filters=dict(estado='e.nombre'),
+        facts='municipios_con_menos_personas',
+    ),
+    QuerySpec(
+        id=16,
+        title='Nombre del o los aeropuertos de los que menos personas parten, muestre la ciudad y el país al que pertenece',
+        sql='''
+            select a.nombre as Aeropuerto, ci.nombre as Cuidad, p.nombre as Pais, count(distinct c.cve_clientes) as Número_de_personas
+            from clientes as c
+            join ocupaciones as o on o.cve_clientes = c.cve_clientes
+            join detalle_vuelos as dv on dv.cve_detalle_vuelos = o.cve_detalle_vuelos
+            join vuelos as v on v.cve_vuelos = dv.cve_vuelos
+            join aeropuertos a on a.cve_aeropuertos = v.cve_aeropuertos__destino
+            join ciudades as ci on ci.cve_ciudades = a.cve_ciudades
+            join paises as p on p.cve_paises = ci.cve_paises
+            group by a.nombre,ci.nombre,p.nombre
+            order by count(distinct c.cve_clientes) asc
+        ''',
+        columns=['Aeropuerto', 'Cuidad', 'Pais', 'Número_de_personas'],
+        metric_column='Número_de_personas',
+        chart=dict(
+            bar_x_col='Aeropuerto',
+            bar_y_col='Número_de_personas',
+            hist_col='Número_de_personas',
+            pie_index_col='Aeropuerto',
+            pie_values_col='Número_de_personas',
+            orientation='horizontal',
+        ),
+        cost='high',
+        filters=dict(fecha='dv.fecha_hora_salida'),
+    ),
+]:
+    register_query(_spec)
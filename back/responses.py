@@ -0,0 +1,66 @@
+import gzip
+import hashlib
+import json
+import zlib
+
+from flask import Response
+
+# brotli is optional, without it the responses are compressed with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+# best encoding accepted by the client: br, gzip or None
+def choose_encoding(request):
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+# compress a body sent by parts; each part is flushed so the client gets it without waiting for the end
+def compress_stream(chunks, encoding):
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=5)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+    else:
+        yield from chunks
+
+
+# compact json with a strong etag (given or from its content), answers 304 when the client already has it
+def json_response(payload, request, etag=None, cache_control='private, no-cache'):
+    body = json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+    encoding = choose_encoding(request) if len(body) >= MIN_COMPRESS_BYTES else None
+    response = Response(body, mimetype='application/json')
+    #each encoding is a different representation, so it is part of the etag
+    etag = etag or hashlib.sha1(body).hexdigest()
+    response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    response.make_conditional(request)
+    if response.status_code == 200 and encoding:
+        response.set_data(compress(body, encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
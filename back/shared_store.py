@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import namedtuple
+
+from export import arrow_table, pa
+
+# result read from the store; rows is a read only view over the mapped file
+SharedResult = namedtuple('SharedResult', ['columns', 'rows', 'db_time', 'created_at', 'snapshot_at', 'approximate'])
+
+
+# rows of an arrow table as a sequence of tuples, converted only when they are read (a page,
+# a slice for the dashboard or the export); the dataframe is built from the table by columns,
+# only for the request that needs it
+class ArrowRows:
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self.table.num_rows)
+            filas = _tuples(self.table.slice(start, max(stop - start, 0)))
+            return filas[::step] if step != 1 else filas
+        if index < 0:
+            index += self.table.num_rows
+        if not 0 <= index < self.table.num_rows:
+            raise IndexError(index)
+        return _tuples(self.table.slice(index, 1))[0]
+
+    def __iter__(self):
+        for batch in self.table.to_batches():
+            yield from _tuples(batch)
+
+    # only the given columns (their positions) when it is a part of the result what is needed
+    def to_pandas(self, indices=None):
+        table = self.table if indices is None else self.table.select(list(indices))
+        return table.to_pandas(split_blocks=True)
+
+
+def _tuples(table):
+    return list(zip(*(column.to_pylist() for column in table.columns)))
+
+
+# results shared by every process of the server: each one is an arrow ipc file without compression,
+# so the processes map it in memory instead of reading it, and a sqlite index says which file has
+# the last result of each (database, query id) and when it was computed. The oldest results are
+# removed when the files take more than max_bytes
+class SharedResultStore:
+    def __init__(self, directory, ttl=300, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('pragma journal_mode=wal')
+            conn.execute('''
+                create table if not exists results (
+                    database text not null,
+                    query_id integer not null,
+                    variant text not null,
+                    path text not null,
+                    bytes integer,
+                    db_time real,
+                    created_at real,
+                    used_at real,
+                    snapshot_at real,
+                    approximate text,
+                    primary key (database, query_id, variant)
+                )
+            ''')
+
+    def _connect(self):
+        return sqlite3.connect(os.path.join(self.directory, 'index.db'), timeout=30)
+
+    # keys are (database, query id, ...) like the ones of ResultCache, the rest is the variant
+    @staticmethod
+    def _key(key):
+        return key[0], key[1], '/'.join(str(part) for part in key[2:])
+
+    def get(self, key):
+        with self._connect() as conn:
+            fila = conn.execute('''
+                select path, db_time, created_at, snapshot_at, approximate from results
+                where database = ? and query_id = ? and variant = ?
+            ''', self._key(key)).fetchone()
+        if fila is None or time.time() - fila[2] > self.ttl:
+            self.misses += 1
+            return None
+        path, db_time, created_at, snapshot_at, approximate = fila
+        try:
+            table = pa.ipc.open_file(pa.memory_map(os.path.join(self.directory, path))).read_all()
+        except (OSError, pa.ArrowInvalid):
+            #removed by another process after reading the index
+            self.misses += 1
+            return None
+        with self._connect() as conn:
+            conn.execute('update results set used_at = ? where database = ? and query_id = ? and variant = ?',
+                         (time.time(), *self._key(key)))
+        self.hits += 1
+        return SharedResult(table.column_names, ArrowRows(table), db_time, created_at, snapshot_at,
+                            json.loads(approximate) if approximate else None)
+
+    # write the result to a temporary file and rename it, a reader never sees it half written;
+    # returns the rows mapped from the file, or None if the rows can not be stored as arrow
+    def put(self, key, columns, rows, db_time, created_at=None, snapshot_at=None, approximate=None):
+        try:
+            table = arrow_table(columns, rows)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError):
+            return None
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+        path = f'{digest}_{uuid.uuid4().hex[:8]}.arrow'
+        full_path = os.path.join(self.directory, path)
+        with pa.OSFile(full_path + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(full_path + '.tmp', full_path)
+        now = time.time()
+        with self._connect() as conn:
+            anterior = conn.execute('select path from results where database = ? and query_id = ? and variant = ?',
+                                    self._key(key)).fetchone()
+            conn.execute('''
+                insert or replace into results (database, query_id, variant, path, bytes, db_time, created_at, used_at, snapshot_at, approximate)
+                values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (*self._key(key), path, os.path.getsize(full_path), db_time, created_at or now, now, snapshot_at,
+                  json.dumps(approximate) if approximate else None))
+        if anterior is not None:
+            self._remove_file(anterior[0])
+        self._evict()
+        return ArrowRows(pa.ipc.open_file(pa.memory_map(full_path)).read_all())
+
+    # keys are (database, query id); None matches everything, like ResultCache.invalidate
+    def invalidate(self, database=None, query_id=None):
+        condiciones, params = [], []
+        if database is not None:
+            condiciones.append('database = ?')
+            params.append(database)
+        if query_id is not None:
+            condiciones.append('query_id = ?')
+            params.append(query_id)
+        where = ' where ' + ' and '.join(condiciones) if condiciones else ''
+        with self._connect() as conn:
+            paths = [fila[0] for fila in conn.execute(f'select path from results{where}', params)]
+            conn.execute(f'delete from results{where}', params)
+        for path in paths:
+            self._remove_file(path)
+        return len(paths)
+
+    # expired results first, then the least used until the files fit in max_bytes
+    def _evict(self):
+        with self._connect() as conn:
+            filas = conn.execute('select path, bytes, created_at from results order by used_at').fetchall()
+            total = sum(fila[1] for fila in filas)
+            now = time.time()
+            removed = []
+            for path, size, created_at in sorted(filas, key=lambda fila: now - fila[2] <= self.ttl):
+                if now - created_at <= self.ttl and total <= self.max_bytes:
+                    break
+                removed.append(path)
+                total -= size
+            conn.executemany('delete from results where path = ?', [(path,) for path in removed])
+        for path in removed:
+            self._remove_file(path)
+
+    #a process that still maps the file keeps reading it, the space is freed when it closes it
+    def _remove_file(self, path):
+        try:
+            os.remove(os.path.join(self.directory, path))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._connect() as conn:
+            entries, total = conn.execute('select count(*), coalesce(sum(bytes), 0) from results').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+        }
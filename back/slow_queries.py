@@ -0,0 +1,172 @@
+import json
+import logging
+import os
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from logs import request_id
+
+try:
+    import fcntl
+except ImportError:
+    #windows runs the development server, a single process writes the log
+    fcntl = None
+
+
+# the connection stayed with showplan on, every statement on it would return a plan instead of its rows
+class ShowplanLeftOn(Exception):
+    pass
+
+
+# estimated plan of sql server, without running the statement
+def sqlserver_plan(conn, consulta, params=()):
+    cursor = conn.cursor()
+    try:
+        cursor.execute('set showplan_xml on')
+        try:
+            cursor.execute(consulta, *params)
+            return cursor.fetchone()[0]
+        finally:
+            try:
+                cursor.execute('set showplan_xml off')
+            except Exception as ex:
+                raise ShowplanLeftOn(f'No se pudo desactivar showplan_xml: {ex}') from ex
+    finally:
+        cursor.close()
+
+
+# the stand-in of bench.py has its own explain (explain query plan of sqlite), any other connection is sql server
+def capture_plan(conn, consulta, params=()):
+    explain = getattr(conn, 'explain', None)
+    if explain is not None:
+        return 'standin', explain(consulta, params)
+    return 'sqlserver', sqlserver_plan(conn, consulta, params)
+
+
+# only sql server reports the io of a statement, the stand-in has no statistics
+def reports_io(conn):
+    return not hasattr(conn, 'explain')
+
+
+# lines of statistics io of the statement; sql server sends them after the rows, with the end of each result
+def io_messages(cursor):
+    messages = []
+    while True:
+        messages.extend(text for _, text in getattr(cursor, 'messages', None) or [])
+        if not hasattr(cursor, 'nextset') or not cursor.nextset():
+            return messages
+
+
+# every process of the server writes to the same file: a lock on a file next to it serializes writing
+# and rotating, and a process whose open file was rotated by another one opens the new one first
+class LockedRotatingFileHandler(RotatingFileHandler):
+    def emit(self, record):
+        if fcntl is None:
+            return super().emit(record)
+        with open(self.baseFilename + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if self.stream is not None and self._rotated():
+                    self.stream.close()
+                    self.stream = None
+                super().emit(record)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _rotated(self):
+        try:
+            return os.fstat(self.stream.fileno()).st_ino != os.stat(self.baseFilename).st_ino
+        except OSError:
+            return True
+
+
+# executions slower than the threshold with their sql, parameters, stages, io and plan, one json
+# object per line in a file that rotates at max_bytes keeping backups old files
+class SlowQueryLog:
+    def __init__(self, path, threshold, max_bytes=10 * 1024 * 1024, backups=5, capture_plans=True, capture_io=True):
+        self.path = path
+        self.threshold = threshold
+        self.backups = backups
+        self.capture_plans = capture_plans
+        self.capture_io = capture_io
+        self.recorded = 0
+        self._handler = LockedRotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+
+    def is_slow(self, seconds):
+        return seconds >= self.threshold
+
+    # sql server only counts the io of a statement when it is asked before running it; the setting
+    # lasts as long as the session, so it is asked once when the pool opens the connection
+    def prepare(self, conn):
+        if self.capture_io and reports_io(conn):
+            cursor = conn.cursor()
+            try:
+                cursor.execute('set statistics io on')
+            finally:
+                cursor.close()
+
+    # called with the connection still open, after reading the rows and before closing the cursor;
+    # connection_broken in the record says that the connection must not go back to the pool
+    def record(self, conn, cursor, consulta, params, seconds, stages, query_id=None, rows=None, error=None):
+        entry = {
+            'ts': datetime.now().isoformat(timespec='seconds'),
+            'query': query_id,
+            'request_id': request_id.get(),
+            'seconds': round(seconds, 3),
+            'stages': {stage: round(value, 3) for stage, value in stages.items()},
+            'rows': rows,
+            'sql': consulta.strip(),
+            'params': list(params),
+            'error': error,
+        }
+        #the plan and the io only explain the time, failing to get them does not fail the query
+        try:
+            entry['io'] = io_messages(cursor) if self.capture_io and reports_io(conn) else None
+        except Exception as ex:
+            entry['io_error'] = str(ex)
+        if self.capture_plans:
+            try:
+                entry['backend'], entry['plan'] = capture_plan(conn, consulta, params)
+            except ShowplanLeftOn as ex:
+                entry['plan_error'] = str(ex)
+                entry['connection_broken'] = True
+            except Exception as ex:
+                entry['plan_error'] = str(ex)
+        self._handler.handle(logging.makeLogRecord({'msg': json.dumps(entry, ensure_ascii=False, default=str)}))
+        self.recorded += 1
+        return entry
+
+    # records of the current file and of the rotated ones, the oldest first
+    def records(self):
+        paths = [f'{self.path}.{number}' for number in range(self.backups, 0, -1)] + [self.path]
+        for path in paths:
+            try:
+                with open(path, encoding='utf-8') as file:
+                    lines = file.readlines()
+            except OSError:
+                continue
+            for line in lines:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    #a line cut by a rotation or a crash
+                    continue
+
+    # by query id: how many slow executions, their total and maximum seconds and the slowest one,
+    # with its plan; the queries with the slowest execution first
+    def worst_offenders(self, limit=20):
+        grupos = {}
+        for entry in self.records():
+            grupo = grupos.setdefault(entry.get('query'), {'query': entry.get('query'), 'count': 0, 'total': 0.0, 'last': None, 'worst': None})
+            grupo['count'] += 1
+            grupo['total'] += entry['seconds']
+            grupo['last'] = entry['ts']
+            if grupo['worst'] is None or entry['seconds'] > grupo['worst']['seconds']:
+                grupo['worst'] = entry
+        for grupo in grupos.values():
+            grupo['mean'] = grupo['total'] / grupo['count']
+        return sorted(grupos.values(), key=lambda grupo: grupo['worst']['seconds'], reverse=True)[:limit]
+
+    def stats(self):
+        sizes = [os.path.getsize(path) for path in [self.path] + [f'{self.path}.{number}' for number in range(1, self.backups + 1)] if os.path.exists(path)]
+        return {'threshold': self.threshold, 'recorded': self.recorded, 'files': len(sizes), 'bytes': sum(sizes)}
@@ -0,0 +1,127 @@
+import json
+import sqlite3
+import threading
+import time
+from decimal import Decimal
+
+
+def _to_json(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+# local sqlite store with the last successful result of each report
+class SnapshotStore:
+    def __init__(self, path):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute('pragma journal_mode=wal')
+            conn.execute('''
+                create table if not exists snapshots (
+                    database text not null,
+                    query_id integer not null,
+                    columns text,
+                    rows text,
+                    measures text,
+                    db_time real,
+                    taken_at real,
+                    last_attempt real,
+                    last_error text,
+                    primary key (database, query_id)
+                )
+            ''')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save(self, database, query_id, columns, rows, db_time, measures):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('''
+                insert into snapshots (database, query_id, columns, rows, measures, db_time, taken_at, last_attempt, last_error)
+                values (?, ?, ?, ?, ?, ?, ?, ?, null)
+                on conflict (database, query_id) do update set
+                    columns = excluded.columns, rows = excluded.rows, measures = excluded.measures,
+                    db_time = excluded.db_time, taken_at = excluded.taken_at,
+                    last_attempt = excluded.last_attempt, last_error = null
+            ''', (database, query_id, json.dumps(columns), json.dumps(rows, default=_to_json),
+                  json.dumps(measures, default=_to_json), db_time, now, now))
+
+    # a failed refresh only records the error, the last good rows stay in service
+    def record_failure(self, database, query_id, error):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('''
+                insert into snapshots (database, query_id, last_attempt, last_error) values (?, ?, ?, ?)
+                on conflict (database, query_id) do update set
+                    last_attempt = excluded.last_attempt, last_error = excluded.last_error
+            ''', (database, query_id, now, str(error)))
+
+    def load(self, database, query_id):
+        with self._connect() as conn:
+            fila = conn.execute(
+                'select columns, rows, measures, db_time, taken_at from snapshots where database = ? and query_id = ? and rows is not null',
+                (database, query_id)).fetchone()
+        if fila is None:
+            return None
+        columns, rows, measures, db_time, taken_at = fila
+        return {
+            'columns': json.loads(columns),
+            'rows': [tuple(row) for row in json.loads(rows)],
+            'measures': json.loads(measures),
+            'db_time': db_time,
+            'taken_at': taken_at,
+        }
+
+    # state of every snapshot without the rows
+    def status(self, database):
+        with self._connect() as conn:
+            filas = conn.execute(
+                'select query_id, taken_at, last_attempt, last_error from snapshots where database = ? order by query_id',
+                (database,)).fetchall()
+        return [{'query_id': query_id, 'taken_at': taken_at, 'last_attempt': last_attempt, 'last_error': last_error}
+                for query_id, taken_at, last_attempt, last_error in filas]
+
+
+# background thread that refreshes every report when its interval has passed
+class SnapshotScheduler:
+    def __init__(self, take_snapshot, list_specs, interval_for, tick=30):
+        self._take_snapshot = take_snapshot
+        self._list_specs = list_specs
+        self._interval_for = interval_for
+        self.tick = tick
+        self._last_attempt = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name='snapshot-scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            for spec in self._list_specs():
+                if self._stop.is_set():
+                    break
+                if time.time() - self._last_attempt.get(spec.id, 0) >= self._interval_for(spec):
+                    self.refresh_now(spec)
+            self._stop.wait(self.tick)
+
+    # run one report now; the errors are recorded by take_snapshot and do not stop the scheduler
+    def refresh_now(self, spec):
+        with self._lock:
+            self._last_attempt[spec.id] = time.time()
+            try:
+                self._take_snapshot(spec)
+                return True
+            except Exception:
+                return False
+
+    def next_due(self, spec):
+        return self._last_attempt.get(spec.id, 0) + self._interval_for(spec)
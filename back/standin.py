@@ -0,0 +1,208 @@
+import os
+import re
+import sqlite3
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+# names returned by datename(month, ...) in a sql server with us_english
+MONTH_NAMES = ['January', 'February', 'March', 'April', 'May', 'June', 'July', 'August',
+               'September', 'October', 'November', 'December']
+
+# rows of each table with scale 1; estados stay at 32 like the real catalog
+BASE_ROWS = {
+    'paises': 20,
+    'ciudades': 200,
+    'aeropuertos': 300,
+    'aerolineas': 15,
+    'vuelos': 2000,
+    'detalle_vuelos': 20000,
+    'estados': 32,
+    'municipios': 2500,
+    'clientes': 50000,
+    'ocupaciones': 150000,
+}
+
+SCHEMA = '''
+    create table paises (cve_paises integer primary key, nombre text, clave_internacional text);
+    create table ciudades (cve_ciudades integer primary key, nombre text, cve_paises integer);
+    create table aeropuertos (cve_aeropuertos integer primary key, nombre text, clave_internacional text, cve_ciudades integer);
+    create table aerolineas (cve_aerolineas integer primary key, nombre text);
+    create table vuelos (cve_vuelos integer primary key, cve_aerolineas integer, cve_aeropuertos__origen integer, cve_aeropuertos__destino integer);
+    create table detalle_vuelos (cve_detalle_vuelos integer primary key, cve_vuelos integer, fecha_hora_salida text);
+    create table estados (cve_estados integer primary key, nombre text);
+    create table municipios (cve_municipios integer primary key, nombre text, cve_estados integer);
+    create table clientes (cve_clientes integer primary key, nombre text, fecha_nacimiento text, cve_estados integer, cve_municipios integer);
+    create table ocupaciones (cve_ocupaciones integer primary key, cve_clientes integer, cve_detalle_vuelos integer);
+    create index ix_ocupaciones_clientes on ocupaciones (cve_clientes);
+    create index ix_ocupaciones_detalle on ocupaciones (cve_detalle_vuelos);
+    create index ix_detalle_vuelos_fecha on detalle_vuelos (fecha_hora_salida);
+'''
+
+
+def _year(value):
+    return int(str(value)[:4]) if value is not None else None
+
+
+def _month(value):
+    return int(str(value)[5:7]) if value is not None else None
+
+
+def _datename(part, value):
+    if value is None:
+        return None
+    if part == 'month':
+        return MONTH_NAMES[_month(value) - 1]
+    return str(_year(value))
+
+
+# datediff(year, ...) of sql server only compares the years
+def _datediff(part, start, end):
+    if start is None or end is None:
+        return None
+    return _year(end) - _year(start)
+
+
+def _getdate():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+# the few t-sql constructs used by the registered queries, written for sqlite
+def translate(consulta):
+    consulta = re.sub(r'\b(datename|datediff)\(\s*(\w+)\s*,', r"\1('\2',", consulta, flags=re.I)
+    top = re.search(r'\bselect\s+top\s+(\d+)\s', consulta, flags=re.I)
+    if top:
+        consulta = f"{consulta[:top.start()]}select {consulta[top.end():].rstrip()} limit {top.group(1)}"
+    return consulta
+
+
+# dates as the text they are stored as, so they compare like in the server
+def _as_param(value):
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    return value.isoformat() if isinstance(value, date) else value
+
+
+# cursor with the pyodbc calls used by the app: execute(sql, *params), fetchmany, description
+class StandInCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, consulta, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        self._cursor.execute(translate(consulta), [_as_param(param) for param in params])
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=1):
+        return self._cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class StandInConnection:
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.create_function('year', 1, _year, deterministic=True)
+        self._conn.create_function('month', 1, _month, deterministic=True)
+        self._conn.create_function('datename', 2, _datename, deterministic=True)
+        self._conn.create_function('datediff', 3, _datediff, deterministic=True)
+        self._conn.create_function('getdate', 0, _getdate)
+
+    def cursor(self):
+        return StandInCursor(self._conn.cursor())
+
+    # explain query plan of sqlite as an indented tree, for the slow query log
+    def explain(self, consulta, params=()):
+        depth = {0: -1}
+        lines = []
+        for node, parent, _, detail in self._conn.execute('explain query plan ' + translate(consulta), [_as_param(param) for param in params]):
+            depth[node] = depth.get(parent, -1) + 1
+            lines.append('  ' * depth[node] + detail)
+        return '\n'.join(lines)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def table_sizes(conn):
+    sizes = {}
+    for table in BASE_ROWS:
+        cursor = conn.cursor()
+        cursor.execute(f'select count(*) from {table}')
+        sizes[table] = cursor.fetchone()[0]
+        cursor.close()
+    return sizes
+
+
+def connect(path):
+    return StandInConnection(path)
+
+
+# aribus380 tables with random data; the same scale and seed always give the same database
+def generate(path, scale=1.0, seed=380):
+    if os.path.exists(path):
+        os.remove(path)
+    rng = np.random.default_rng(seed)
+    sizes = {table: rows if table == 'estados' else max(1, int(rows * scale)) for table, rows in BASE_ROWS.items()}
+
+    def keys(table, count, skew=None):
+        # a zipf-like skew so some estados, airports and clients appear much more than others
+        if skew is None:
+            return rng.integers(0, sizes[table], count)
+        weights = 1.0 / np.arange(1, sizes[table] + 1) ** skew
+        return rng.choice(sizes[table], count, p=weights / weights.sum())
+
+    start = datetime(2015, 1, 1)
+    salidas = [start + timedelta(minutes=int(minutos))
+               for minutos in rng.integers(0, 10 * 365 * 24 * 60, sizes['detalle_vuelos'])]
+    nacimientos = [datetime(1940, 1, 1) + timedelta(days=int(dias))
+                   for dias in rng.integers(0, 80 * 365, sizes['clientes'])]
+    municipios_estado = keys('estados', sizes['municipios'], skew=0.8)
+    municipios_clientes = keys('municipios', sizes['clientes'], skew=0.6)
+
+    tables = {
+        'paises': [(i, f'País {i}', f'P{i:02d}') for i in range(sizes['paises'])],
+        'ciudades': [(i, f'Ciudad {i}', int(p)) for i, p in enumerate(keys('paises', sizes['ciudades']))],
+        'aeropuertos': [(i, f'Aeropuerto {i}', f'A{i:03d}', int(c)) for i, c in enumerate(keys('ciudades', sizes['aeropuertos']))],
+        'aerolineas': [(i, f'Aerolínea {i}') for i in range(sizes['aerolineas'])],
+        'vuelos': [(i, int(a), int(o), int(d)) for i, (a, o, d) in enumerate(zip(
+            keys('aerolineas', sizes['vuelos'], skew=0.5), keys('aeropuertos', sizes['vuelos'], skew=0.7),
+            keys('aeropuertos', sizes['vuelos'], skew=0.7)))],
+        'detalle_vuelos': [(i, int(v), salida.strftime('%Y-%m-%d %H:%M:%S'))
+                           for i, (v, salida) in enumerate(zip(keys('vuelos', sizes['detalle_vuelos']), salidas))],
+        'estados': [(i, f'Estado {i}') for i in range(sizes['estados'])],
+        'municipios': [(i, f'Municipio {i}', int(e)) for i, e in enumerate(municipios_estado)],
+        # the estado of a client is the one of its municipio
+        'clientes': [(i, f'Cliente {i}', nacimiento.strftime('%Y-%m-%d'), int(municipios_estado[m]), int(m))
+                     for i, (nacimiento, m) in enumerate(zip(nacimientos, municipios_clientes))],
+        'ocupaciones': [(i, int(c), int(d)) for i, (c, d) in enumerate(zip(
+            keys('clientes', sizes['ocupaciones'], skew=0.3), keys('detalle_vuelos', sizes['ocupaciones'])))],
+    }
+
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    for table, rows in tables.items():
+        marks = ', '.join('?' * len(rows[0]))
+        conn.executemany(f'insert into {table} values ({marks})', rows)
+    conn.commit()
+    conn.execute('analyze')
+    conn.close()
+    return sizes
@@ -0,0 +1,70 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+
+from charts import plt, sns, warm_worker
+from main import WARMUP, app, chart_renderer, snapshot_scheduler, sql
+from measures import np, pd
+
+log = logging.getLogger('app')
+
+# the snapshot scheduler runs in the worker that holds this lock
+SCHEDULER_LOCK = os.getenv('SCHEDULER_LOCK', 'scheduler.lock')
+
+# files of this worker that have to stay open, like the lock of the scheduler
+worker_state = {}
+
+
+# the heavy libraries and the fonts are loaded before the workers are forked (gunicorn preload_app),
+# so every worker starts with them and shares their memory with the master
+def preload():
+    start_time = time.perf_counter()
+    for module in (pd, np, plt, sns, sql):
+        try:
+            module.load()
+        except Exception as ex:
+            log.warning('No se pudo precargar %r: %s', module, ex)
+    try:
+        warm_worker()
+    except Exception as ex:
+        log.warning('Error en la precarga: %s', ex)
+    log.info('Librerías precargadas en %.3f segundos', time.perf_counter() - start_time,
+             extra={'fields': {'pid': os.getpid()}})
+
+
+# only one worker runs the snapshot scheduler; the others try to take the lock from time to time,
+# so when that worker is recycled another one takes its place. The lock is held while the
+# returned file is open, that is until the worker exits
+def start_scheduler(scheduler, lock_path=SCHEDULER_LOCK, retry=30):
+    lock_file = open(lock_path, 'a')
+
+    def run():
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                time.sleep(retry)
+                continue
+            log.info('Programador de instantáneas iniciado', extra={'fields': {'pid': os.getpid()}})
+            scheduler.start()
+            return
+
+    threading.Thread(target=run, name='scheduler-lock', daemon=True).start()
+    return lock_file
+
+
+# called by gunicorn in each worker after the fork
+def worker_started():
+    if snapshot_scheduler is not None:
+        worker_state['scheduler_lock'] = start_scheduler(snapshot_scheduler)
+    if WARMUP:
+        chart_renderer.warm_up()
+
+
+def worker_stopping():
+    chart_renderer.shutdown()
+
+
+preload()
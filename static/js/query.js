@@ -0,0 +1,24 @@
+// replace the placeholders of the graphs when the server finishes rendering them
+var graphs = document.querySelectorAll('img[data-graph]');
+for (var i = 0; i < graphs.length; i++) {
+    waitGraph(graphs[i], 0);
+}
+
+function waitGraph(img, attempt) {
+    var status = img.previousElementSibling;
+    fetch(graphStatusUrl + '?file=' + encodeURIComponent(img.dataset.graph))
+        .then(function(response) { return response.json(); })
+        .then(function(data) {
+            if (data.status === 'ready') {
+                img.src = img.dataset.src;
+                status.style.display = 'none';
+            } else if (data.status === 'pending') {
+                setTimeout(function() { waitGraph(img, attempt + 1); }, Math.min(250 * (attempt + 1), 2000));
+            } else {
+                status.textContent = data.error || 'No fue posible generar el gráfico';
+            }
+        })
+        .catch(function() {
+            status.textContent = 'No fue posible generar el gráfico';
+        });
+}
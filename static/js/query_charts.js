@@ -0,0 +1,57 @@
+// draw the graphs in the browser from the columnar json of the api
+fetch(queryApiUrl)
+    .then(function(response) { return response.json(); })
+    .then(function(result) {
+        var canvases = document.querySelectorAll('canvas[data-chart]');
+        for (var i = 0; i < canvases.length; i++) {
+            drawChart(canvases[i], result);
+        }
+    })
+    .catch(function() {
+        var status = document.querySelectorAll('.graph_status');
+        for (var i = 0; i < status.length; i++) {
+            status[i].textContent = 'No fue posible generar el gráfico';
+        }
+    });
+
+function column(result, name) {
+    return result.data[result.columns.indexOf(name)];
+}
+
+// same bins as the histogram of the server: 10 bins between the minimum and the maximum
+function histogram(values, bins) {
+    values = values.filter(function(value) { return value !== null; });
+    var min = Math.min.apply(null, values);
+    var max = Math.max.apply(null, values);
+    var width = (max - min) / bins || 1;
+    var counts = new Array(bins).fill(0);
+    var labels = [];
+    for (var i = 0; i < values.length; i++) {
+        counts[Math.min(Math.floor((values[i] - min) / width), bins - 1)]++;
+    }
+    for (var b = 0; b < bins; b++) {
+        labels.push(Math.round(min + b * width));
+    }
+    return {labels: labels, counts: counts};
+}
+
+function drawChart(canvas, result) {
+    var chart = result.chart;
+    var kind = canvas.dataset.chart;
+    var config;
+    if (kind === 'bar' && chart.bar_x_col && chart.bar_y_col) {
+        config = {type: 'bar', data: {labels: column(result, chart.bar_x_col), datasets: [{label: chart.bar_y_col, data: column(result, chart.bar_y_col)}]}};
+    } else if (kind === 'hist' && chart.hist_col) {
+        var hist = histogram(column(result, chart.hist_col), 10);
+        config = {type: 'bar', data: {labels: hist.labels, datasets: [{label: 'Frequency', data: hist.counts, barPercentage: 1, categoryPercentage: 1}]}};
+    } else if (kind === 'pie' && chart.pie_index_col && chart.pie_values_col) {
+        config = {type: 'pie', data: {labels: column(result, chart.pie_index_col), datasets: [{data: column(result, chart.pie_values_col)}]}, options: {plugins: {legend: {display: false}}}};
+    }
+    var status = canvas.previousElementSibling;
+    if (!config) {
+        status.textContent = 'Gráfico no disponible';
+        return;
+    }
+    status.style.display = 'none';
+    new Chart(canvas, config);
+}